@@ -1,11 +1,11 @@
 from __future__ import annotations
 import subprocess
-from .config import load_config
+from .config import get_config
 import re
 
 
 def start_ap() -> int:
-    cfg = load_config()
+    cfg = get_config()
     ssid = cfg['ap']['ssid']
     pwd = cfg['ap']['password']
     # Prefer NetworkManager hotspot (Bookworm default)
@@ -1,20 +1,26 @@
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from pathlib import Path
-import hashlib
-import shutil
 import os
+import queue
+import random
+import threading
 import time
-from typing import Callable, Iterable, List, Optional, Tuple
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
 
 from ..paths import Paths
-from ..config import load_config
-import shutil as _shutil
+from ..config import get_config
+from ..hardware.power import Throttle
+from ..inventory import PHOTO, SIDECAR, VIDEO, MediaEntry, pair_sidecars, scan
+from ..proxies.generate import content_key
+from ..proxies.sidecars import POSTER_EXTS, PROXY_EXTS, stage_sidecars
 from .scanner import classify_device_code
-
-
-PHOTO_EXTS = {'.jpg', '.jpeg', '.png', '.rw2', '.cr2', '.nef', '.raf', '.dng', '.arw'}
-VIDEO_EXTS = {'.mp4', '.mov', '.m4v'}
+from .cards import CardStore, volume_id
+from .manifest import Manifest
+from .journal import COMMITTED, INFLIGHT, Journal, part_path
+from .copyio import DEFAULT_BLOCK_SIZE, copy_file, hash_file, sync_files, write_all
+from .pipeline import Stage
+from .planner import SKIP, BackupPlan, PlannedFile, InsufficientSpace, Progress, RateMeter, add_sidecar_bytes, check_space, plan_backup, tagged_name
 
 
 @dataclass
@@ -25,91 +31,505 @@ class CopyResult:
     bytes_copied: int
     device_name: str
     errors: List[str]
+    verify_mode: str = 'fast'
+    verify_throughput: float = 0.0   # bytes/s read back by the verifier
+    written: List[Path] = field(default_factory=list)  # destinations copied or replaced by this run
+    renamed: List[Path] = field(default_factory=list)  # written under a card-tagged name: the plain name held other content
+
+
+def sha256sum(path: Path, block_size: int = DEFAULT_BLOCK_SIZE) -> str:
+    return hash_file(path, 'sha256', block_size)
+
+
+class Verifier:
+    """Post-copy check of a temp copy against its source.
+
+    ``stream_algo`` names the hash computed over the copy stream (None when the
+    mode needs none). ``full_hash`` modes also dedup by hash rather than by
+    size+mtime. Read-back time is accumulated for ``throughput``.
+
+    Every mode first checks the copy against ``expected``, the source size
+    recorded when the backup was planned: n and the copy's size both come
+    from the copy itself, so a source cut short mid-read (card pulled, I/O
+    error read as EOF) would otherwise pass.
+    """
+
+    name = 'fast'
+    stream_algo: Optional[str] = None
+    full_hash = False
+
+    def __init__(self, block_size: int = DEFAULT_BLOCK_SIZE):
+        self.block_size = block_size
+        self.bytes_read = 0
+        self.seconds = 0.0
+
+    def _complete(self, dst: Path, n: int, expected: int) -> bool:
+        return n == expected and dst.stat().st_size == expected
+
+    def verify(self, src: Path, dst: Path, n: int, digest: Optional[str], expected: int) -> bool:
+        return self._complete(dst, n, expected)
+
+    @property
+    def throughput(self) -> float:
+        return self.bytes_read / self.seconds if self.seconds > 0 else 0.0
+
+    def _timed(self, fn, nbytes: int):
+        t0 = time.monotonic()
+        out = fn()
+        self.seconds += time.monotonic() - t0
+        self.bytes_read += nbytes
+        return out
+
+
+class HashVerifier(Verifier):
+    """Full-file hash of the copy compared with the digest of the copy stream."""
+
+    full_hash = True
+
+    def __init__(self, algo: str, block_size: int = DEFAULT_BLOCK_SIZE):
+        super().__init__(block_size)
+        self.name = self.stream_algo = algo
+
+    def verify(self, src: Path, dst: Path, n: int, digest: Optional[str], expected: int) -> bool:
+        if not self._complete(dst, n, expected):
+            return False
+        return digest == self._timed(lambda: hash_file(dst, self.stream_algo, self.block_size), n)
+
+
+class SampledVerifier(Verifier):
+    """Compare head, tail and N random stripes of source and copy.
+
+    Catches truncated and corrupt copies at a fraction of a full hash; the
+    stripe positions are seeded from the file name so reruns are repeatable.
+    Stripes are ``stripe_size`` bytes, independent of the copy buffer, so a
+    JPEG reads back a few hundred KiB from the card rather than all of it;
+    only files no larger than the stripes together are compared in full.
+    """
+
+    name = 'sampled'
+
+    def __init__(self, stripes: int = 8, stripe_size: int = 64 * 1024, block_size: int = DEFAULT_BLOCK_SIZE):
+        super().__init__(block_size)
+        self.stripes = stripes
+        self.stripe_size = max(1, stripe_size)
+
+    def verify(self, src: Path, dst: Path, n: int, digest: Optional[str], expected: int) -> bool:
+        if not self._complete(dst, n, expected):
+            return False
+        size = expected
+        stripe = self.stripe_size
+        if size <= stripe * (self.stripes + 2):
+            # Small file: the stripes would cover it anyway, compare it whole
+            stripe = self.block_size
+            offsets = list(range(0, size, stripe)) or [0]
+        else:
+            rnd = random.Random(f'{src.name}:{size}')
+            offsets = [0, size - stripe] + sorted(rnd.randrange(stripe, size - stripe) for _ in range(self.stripes))
+
+        def _compare() -> bool:
+            with open(src, 'rb', buffering=0) as a, open(dst, 'rb', buffering=0) as b:
+                for off in offsets:
+                    a.seek(off)
+                    b.seek(off)
+                    if a.read(stripe) != b.read(stripe):
+                        return False
+            return True
+
+        return self._timed(_compare, min(size, stripe * len(offsets)))
+
+
+VERIFY_MODES = ('fast', 'sampled', 'blake2b', 'sha256')
+
+
+def get_verifier(mode: str, cfg: Optional[dict] = None, block_size: int = DEFAULT_BLOCK_SIZE) -> Verifier:
+    if mode in ('sha256', 'blake2b'):
+        return HashVerifier(mode, block_size)
+    if mode == 'sampled':
+        vcfg = (cfg or {}).get('verify', {})
+        return SampledVerifier(int(vcfg.get('sample_stripes', 8)), int(vcfg.get('sample_stripe_kb', 64)) * 1024, block_size)
+    return Verifier(block_size)
+
+
+class WriteQueue:
+    """Bounded pool of block buffers drained by a single NVMe writer thread.
+
+    Readers for several cards fill buffers from the pool and queue them; the
+    writer thread writes them and hands them back. The NVMe sees a single
+    sequential writer and memory stays capped at ``depth`` blocks.
+    """
+
+    def __init__(self, depth: int = 32, block_size: int = DEFAULT_BLOCK_SIZE):
+        depth = max(1, depth)
+        self._free: queue.Queue = queue.Queue()
+        for _ in range(depth):
+            self._free.put(memoryview(bytearray(block_size)))
+        self._q: queue.Queue = queue.Queue()
+        self._errors: Dict[int, BaseException] = {}
+        self._thread = threading.Thread(target=self._run, name='nvme-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            f, buf, n, done = item
+            if done is not None:
+                done.set()
+                continue
+            try:
+                if id(f) not in self._errors:
+                    write_all(f, buf[:n])
+            except BaseException as e:  # surfaced to the reader on flush()
+                self._errors[id(f)] = e
+            finally:
+                self._free.put(buf)
+
+    def acquire(self) -> memoryview:
+        """Take a free block buffer, waiting for the writer if all are queued."""
+        return self._free.get()
+
+    def release(self, buf: memoryview) -> None:
+        self._free.put(buf)
+
+    def write(self, f: BinaryIO, buf: memoryview, n: int) -> None:
+        self._q.put((f, buf, n, None))
+
+    def flush(self, f: BinaryIO) -> None:
+        """Block until every queued write for f has landed; re-raise its error."""
+        done = threading.Event()
+        self._q.put((f, None, 0, done))
+        done.wait()
+        err = self._errors.pop(id(f), None)
+        if err is not None:
+            raise err
 
+    def close(self) -> None:
+        self._q.put(None)
+        self._thread.join()
 
-def sha256sum(path: Path) -> str:
-    h = hashlib.sha256()
-    with open(path, 'rb') as f:
-        for chunk in iter(lambda: f.read(1024 * 1024), b''):
-            h.update(chunk)
-    return h.hexdigest()
 
+class PathLocks:
+    """Per-destination locks so concurrent cards never write the same file.
 
-def _iterate_media_files(root: Path) -> Iterable[Path]:
-    for dirpath, _, files in os.walk(root):
-        for fn in files:
-            p = Path(dirpath) / fn
-            if p.suffix.lower() in PHOTO_EXTS | VIDEO_EXTS:
-                yield p
+    A lock may be released from another thread than the one that took it, which
+    lets the copy stage hand a destination over to the verify stage.
+    """
 
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks: Dict[Path, threading.Lock] = {}
 
-def copy_from_source(source_root: Path, paths: Paths, verify_mode: str = 'fast', progress_cb: Optional[Callable[[int, int], None]] = None) -> CopyResult:
+    def acquire(self, path: Path, blocking: bool = True) -> bool:
+        with self._guard:
+            lock = self._locks.setdefault(path, threading.Lock())
+        return lock.acquire(blocking)
+
+    def release(self, path: Path) -> None:
+        self._locks[path].release()
+
+
+def _stat(path: Path) -> Optional[os.stat_result]:
+    try:
+        return path.stat()
+    except OSError:
+        return None
+
+
+def copy_with_hash(src: Path, dst: Path, algo: Optional[str] = 'sha256', writer: Optional[WriteQueue] = None,
+                   block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[int, Optional[str]]:
+    """Copy src to dst reading each block once; the same buffer feeds the hash.
+
+    The backend is picked by copyio.copy_file: with the shared NVMe write queue
+    every mode goes through its buffers and writer thread; without one, a
+    kernel copy when nothing needs hashing (no bytes pass through Python) and
+    reusable readinto buffers otherwise. Returns (bytes written, hex digest of
+    the source stream in ``algo`` or None).
+    """
+    return copy_file(src, dst, algo, writer, block_size)
+
+
+# Tells the verify stage to commit its pending batch now
+_FLUSH = object()
+
+
+@dataclass
+class _Copied:
+    """A file copied to its temp name, waiting for the verify stage."""
+    f: PlannedFile
+    part: Path
+    existed: bool
+    n: int
+    digest: Optional[str]
+    committed: bool = False
+    error: Optional[str] = None
+
+
+def list_media_files(source_root: Path, sidecars: bool = False) -> List[MediaEntry]:
+    """Inventory a card's DCIM folder (or the whole source without one), rel to source_root."""
+    root = source_root / 'DCIM' if (source_root / 'DCIM').exists() else source_root
+    return list(scan(root, kinds=(PHOTO, VIDEO, SIDECAR) if sidecars else None, rel_to=source_root))
+
+
+def device_label_for(source_root: Path, cfg: dict) -> str:
     device_code = classify_device_code(source_root)
-    files = list(_iterate_media_files(source_root / 'DCIM')) if (source_root / 'DCIM').exists() else list(_iterate_media_files(source_root))
-    total = len(files)
-    copied = skipped = replaced = 0
-    bytes_copied = 0
+    return cfg.get('device_labels', {}).get(device_code, device_code)
+
+
+def prepare_backup(source_root: Path, paths: Paths, verify_mode: str, manifest: Manifest, journal: Journal,
+                   cards: Optional[CardStore] = None) -> BackupPlan:
+    """Recover an interrupted run of this card, then plan it and journal the plan.
+
+    The journal is keyed by the card's volume id rather than its mount point,
+    so an interrupted run resumes even if the card comes back elsewhere. With
+    a CardStore, files unchanged since the card's last complete backup are
+    skipped without being hashed again.
+    """
+    card_id = volume_id(source_root)
+    # Resume: drop half-written copies of an interrupted run, keep its commits
+    journal.recover(card_id)
+    cfg = get_config()
+    known, hwm = ({}, None) if cards is None else (cards.snapshot(card_id), cards.high_water_mark(card_id))
+    entries = list_media_files(source_root, sidecars=True)
+    plan = plan_backup(source_root, [e for e in entries if e.kind != SIDECAR], paths, device_label_for(source_root, cfg),
+                       not get_verifier(verify_mode, cfg).full_hash, manifest, journal.committed(card_id), known, hwm,
+                       card_id=card_id)
+    plan.sidecars = pair_sidecars(entries)
+    if cfg.get('previews', {}).get('use_camera_proxies', True):
+        add_sidecar_bytes(plan, PROXY_EXTS + POSTER_EXTS)
+    listing = [(f.rel, f.size, f.mtime_ns) for f in plan.files]
+    journal.plan(card_id, listing)
+    return plan
+
+
+def copy_from_source(source_root: Path, paths: Paths, verify_mode: str = 'fast', progress_cb: Optional[Callable[[Progress], None]] = None,
+                     writer: Optional[WriteQueue] = None, locks: Optional[PathLocks] = None, manifest: Optional[Manifest] = None,
+                     journal: Optional[Journal] = None, plan: Optional[BackupPlan] = None, cards: Optional[CardStore] = None,
+                     throttle: Optional[Throttle] = None) -> CopyResult:
     errors: List[str] = []
 
-    cfg = load_config()
-    min_free = int(cfg.get('limits', {}).get('min_free_gb', 10)) * 1_000_000_000
+    cfg = get_config()
+    min_free_gb = float(cfg.get('limits', {}).get('min_free_gb', 10))
+    block_size = int(cfg.get('backup', {}).get('block_size_kb', 1024)) * 1024
 
-    labels = cfg.get('device_labels', {})
-    device_label = labels.get(device_code, device_code)
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = Manifest(paths.manifest_db, paths.trips)
+    own_journal = journal is None
+    if own_journal:
+        journal = Journal(paths.journal_db)
+    own_cards = cards is None
+    if own_cards:
+        cards = CardStore(paths.cards_db)
 
-    for i, src in enumerate(files, 1):
+    if plan is None:
+        plan = prepare_backup(source_root, paths, verify_mode, manifest, journal, cards)
         try:
-            # Date folder from modification time
-            date_str = time.strftime('%Y-%m-%d', time.localtime(src.stat().st_mtime))
-            if src.suffix.lower() in PHOTO_EXTS:
-                dst_dir = paths.photos_dir()
-            else:
-                dst_dir = paths.videos_dir(date_str, device_label)
-            dst = dst_dir / src.name
-
-            # free space check: keep min_free_gb
-            usage = _shutil.disk_usage(str(paths.nvme_mount))
-            if usage.free - src.stat().st_size < min_free:
-                errors.append('Low space: stopping backup')
-                break
+            check_space([plan], paths, min_free_gb)
+        except InsufficientSpace as e:
+            errors.append(f'Low space: {e}')
+            plan.files = []
+    device_label = plan.device_label
+    source_key = plan.card_id
+
+    files_total = len(plan.files)
+    verifier = get_verifier(verify_mode, cfg, block_size)
+    locks = locks or PathLocks()
+    counts = {'copied': 0, 'skipped': 0, 'replaced': 0, 'bytes': 0, 'files_done': 0, 'bytes_done': 0}
+    written: List[Path] = []
+    progress_lock = threading.Lock()
+    stop = threading.Event()
+    meter = RateMeter()
+    meter.add(0)
+
+    def _done(f, key: Optional[str] = None, n: int = 0) -> None:
+        with progress_lock:
+            if key:
+                counts[key] += 1
+            if key in ('copied', 'replaced'):
+                written.append(f.dst)
+            counts['bytes'] += n
+            counts['files_done'] += 1
+            if f.action != SKIP:
+                counts['bytes_done'] += f.size
+                meter.add(counts['bytes_done'])
+            if progress_cb:
+                progress_cb(Progress(device_label, counts['files_done'], files_total, counts['bytes_done'], plan.work_bytes,
+                                     meter.rate(), meter.eta(plan.work_bytes - counts['bytes_done'])))
+
+    # Durable mode group-commits each batch of copies to disk and drops their
+    # cached pages, so the verify read-back really hits the NVMe.
+    vcfg = cfg.get('verify', {})
+    durable = bool(vcfg.get('durable', True))
+    batch_files = int(vcfg.get('fsync_batch_files', 64)) if durable else 1
+    batch_bytes = int(vcfg.get('fsync_batch_mb', 256)) * 1_000_000
+    batch: List[_Copied] = []
+
+    def _verify(job: _Copied) -> bool:
+        # Any stream digest comes from the copy itself, so hash modes only read the copy back
+        return verifier.verify(job.f.src, job.part, job.n, job.digest, job.f.size)
+
+    def _commit_batch() -> None:
+        jobs = batch[:]
+        batch.clear()
+        try:
+            if durable:
+                sync_files([j.part for j in jobs])
+        except Exception as e:  # pragma: no cover
+            for j in jobs:
+                j.error = f'Error copying {j.f.src}: {e}'
+        for job in jobs:
+            f, part = job.f, job.part
+            try:
+                if job.error:
+                    continue
+                if stop.is_set():
+                    # A previous file failed verify: leave the rest for the next run
+                    part.unlink(missing_ok=True)
+                    continue
+                if not _verify(job):
+                    part.unlink(missing_ok=True)
+                    job.n, job.digest = copy_with_hash(f.src, part, verifier.stream_algo, writer, block_size)
+                    if durable:
+                        sync_files([part])
+                    if not _verify(job):
+                        part.unlink(missing_ok=True)
+                        errors.append(f'Verify failed: {f.src}')
+                        stop.set()
+                        continue
+                os.replace(part, f.dst)
+                job.committed = True
+            except Exception as e:  # pragma: no cover
+                job.error = f'Error copying {f.src}: {e}'
+        try:
+            if durable:
+                # Make the renames durable before the journal calls them committed
+                sync_files({j.f.dst.parent for j in jobs if j.committed}, drop_cache=False)
+        except Exception as e:  # pragma: no cover
+            errors.append(f'Error syncing backup: {e}')
+        for job in jobs:
+            f = job.f
+            try:
+                if job.committed:
+                    manifest.record(f.dst, job.digest if verifier.stream_algo == 'sha256' else None)
+                    journal.mark(source_key, f.rel, COMMITTED)
+            except Exception as e:  # pragma: no cover
+                job.committed = False
+                job.error = f'Error copying {f.src}: {e}'
+            finally:
+                if job.error:
+                    errors.append(job.error)
+                locks.release(f.dst)
+                if job.committed:
+                    _done(f, 'replaced' if job.existed else 'copied', job.n)
+                else:
+                    _done(f)
+
+    # Stage 2 (NVMe): collect copies into batches, then sync, verify (retrying
+    # once), rename into place and commit. Runs while stage 1 already reads the
+    # next file from the card.
+    def _verify_stage(job) -> None:
+        if job is _FLUSH:
+            _commit_batch()
+            return
+        batch.append(job)
+        if len(batch) >= batch_files or sum(j.n for j in batch) >= batch_bytes:
+            _commit_batch()
+
+    stage = Stage(_verify_stage, depth=int(cfg.get('backup', {}).get('pipeline_depth', 4)), name='verify')
 
-            if dst.exists():
-                # Dedup: compute SHA256 both sides
-                if sha256sum(src) == sha256sum(dst):
-                    skipped += 1
-                    if progress_cb:
-                        progress_cb(i, total)
+    def _already_there(f: PlannedFile, dst: Path, st: Optional[os.stat_result]) -> bool:
+        if st is None or st.st_size != f.size:
+            return False
+        # Dedup against the manifest: the NVMe copy is only rehashed when
+        # it is unknown or was changed outside the app.
+        entry = manifest.lookup(dst, st)
+        if not verifier.full_hash and entry is not None and entry.mtime_ns == f.mtime_ns:
+            return True
+        dst_digest = entry.sha256 if entry is not None and entry.sha256 else sha256sum(dst, block_size)
+        if sha256sum(f.src, block_size) != dst_digest:
+            return False
+        if entry is None or not entry.sha256:
+            manifest.record(dst, dst_digest)
+        return True
+
+    # Stage 1 (card): dedup and copy to a temp name
+    try:
+        for f in plan.files:
+            if stop.is_set():
+                break
+            if f.action == SKIP:
+                _done(f, 'skipped')
+                continue
+            src, dst = f.src, f.dst
+            # Held from dedup until the verify stage commits: another card may target the same name
+            if not locks.acquire(dst, blocking=False):
+                # The holder may be our own pending batch (same name in two DCIM folders)
+                stage.put(_FLUSH)
+                locks.acquire(dst)
+            handed_over = False
+            try:
+                # Decided again here, under the lock: the plan may be stale by now
+                st = _stat(dst)
+                if _already_there(f, dst, st):
+                    _done(f, 'skipped')
                     continue
-                # replace
-                shutil.copy2(src, dst)
-                replaced += 1
-            else:
-                # copy new
-                shutil.copy2(src, dst)
-                copied += 1
-
-            bytes_copied += dst.stat().st_size
-
-            # Post copy verify with one retry if mismatch
-            def _verify() -> bool:
-                if verify_mode == 'sha256':
-                    return sha256sum(src) == sha256sum(dst)
-                return src.stat().st_size == dst.stat().st_size
-
-            if not _verify():
+                if st is not None and not f.tagged:
+                    # The plain name holds other content (another card or folder): keep it
+                    locks.release(dst)
+                    f.dst, f.tagged = tagged_name(dst, source_key, f.rel), True
+                    dst = f.dst
+                    locks.acquire(dst)
+                    st = _stat(dst)
+                    if _already_there(f, dst, st):
+                        _done(f, 'skipped')
+                        continue
+                existed = st is not None
+
+                # Copy to a temp name and rename into place once verified, so dst is
+                # never half-written and a replaced original survives a failed copy.
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                part = part_path(dst)
+                if throttle is not None and not throttle.acquire(blocking=False):
+                    # Low power: land what is already copied, then wait for a read slot
+                    stage.put(_FLUSH)
+                    throttle.acquire()
+                journal.mark(source_key, f.rel, INFLIGHT, dst)
                 try:
-                    dst.unlink(missing_ok=True)
-                except Exception:
-                    pass
-                shutil.copy2(src, dst)
-                if not _verify():
-                    errors.append(f'Verify failed: {src}')
-                    break
+                    n, digest = copy_with_hash(src, part, verifier.stream_algo, writer, block_size)
+                finally:
+                    if throttle is not None:
+                        throttle.release()
+                stage.put(_Copied(f, part, existed, n, digest))
+                handed_over = True
+            except Exception as e:  # pragma: no cover
+                errors.append(f'Error copying {src}: {e}')
+                _done(f)
+            finally:
+                if not handed_over:
+                    locks.release(dst)
+    finally:
+        stage.close()
+        _commit_batch()
 
-        except Exception as e:  # pragma: no cover
-            errors.append(f'Error copying {src}: {e}')
-        finally:
-            if progress_cb:
-                progress_cb(i, total)
+    if written and plan.sidecars and cfg.get('previews', {}).get('use_camera_proxies', True):
+        # Hand the camera's own low-res files to the proxy worker while the card is still here
+        new = set(written)
+        stage_sidecars(((content_key(f.dst.name, f.size, f.mtime_ns), [e.path for e in plan.sidecars[f.src]])
+                        for f in plan.files if f.dst in new and f.src in plan.sidecars), paths.proxies_dir())
 
-    return CopyResult(copied, skipped, replaced, bytes_copied, device_label, errors)
+    copied, skipped, replaced, bytes_copied = counts['copied'], counts['skipped'], counts['replaced'], counts['bytes']
+    if not errors:
+        journal.finish(source_key)
+        if plan.files:
+            cards.record(plan.card_id, ((f.rel, f.size, f.mtime_ns) for f in plan.files))
+    if own_cards:
+        cards.close()
+    if own_journal:
+        journal.close()
+    if own_manifest:
+        manifest.close()
+    new = set(written)
+    renamed = [f.dst for f in plan.files if f.tagged and f.dst in new]
+    return CopyResult(copied, skipped, replaced, bytes_copied, device_label, errors, verifier.name, verifier.throughput, written,
+                      renamed)
@@ -0,0 +1,98 @@
+from __future__ import annotations
+from pathlib import Path
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from ..state.db import connect
+from .scanner import MOUNTINFO, parse_mountinfo
+
+
+def _mount_source(mount: Path, mountinfo: str = MOUNTINFO) -> Optional[str]:
+    try:
+        with open(mountinfo, 'r', encoding='utf-8', errors='replace') as f:
+            for mp, _, source in parse_mountinfo(f.read()):
+                if Path(mp) == mount:
+                    return source
+    except OSError:
+        pass
+    return None
+
+
+def _by_link(kind: str, device: str) -> Optional[str]:
+    d = Path('/dev/disk') / kind
+    try:
+        for link in d.iterdir():
+            if os.path.realpath(link) == os.path.realpath(device):
+                return link.name
+    except OSError:
+        pass
+    return None
+
+
+def volume_id(mount: Path) -> str:
+    """Volume UUID of the mounted card, else its label, else the mount folder name."""
+    device = _mount_source(mount)
+    if device and device.startswith('/dev/'):
+        uuid = _by_link('by-uuid', device)
+        if uuid:
+            return f'uuid:{uuid}'
+        label = _by_link('by-label', device)
+        if label:
+            return f'label:{label}'
+    return f'label:{mount.name}'
+
+
+class CardStore:
+    """Per-card memory: last fully backed-up listing and its high-water mark.
+
+    The high-water mark is the newest mtime already backed up; anything newer
+    is new footage by definition, anything at or below it is looked up in the
+    snapshot.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._db = connect(
+            db_path,
+            'CREATE TABLE IF NOT EXISTS cards ('
+            ' card_id TEXT PRIMARY KEY, hwm_mtime_ns INTEGER, last_backup REAL);'
+            'CREATE TABLE IF NOT EXISTS card_files ('
+            ' card_id TEXT NOT NULL, rel TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' PRIMARY KEY (card_id, rel));',
+        )
+
+    def high_water_mark(self, card_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute('SELECT hwm_mtime_ns FROM cards WHERE card_id=?', (card_id,)).fetchone()
+        return row[0] if row else None
+
+    def snapshot(self, card_id: str) -> Dict[str, Tuple[int, int]]:
+        """rel -> (size, mtime_ns) of the last completed backup of this card."""
+        with self._lock:
+            rows = self._db.execute('SELECT rel, size, mtime_ns FROM card_files WHERE card_id=?', (card_id,)).fetchall()
+        return {rel: (size, mtime) for rel, size, mtime in rows}
+
+    def record(self, card_id: str, files: Iterable[Tuple[str, int, int]]) -> None:
+        """Replace the snapshot of a card after a backup completed without errors.
+
+        ``files`` is the card's full (rel, size, mtime_ns) listing.
+        """
+        files = list(files)
+        hwm = max((m for _, _, m in files), default=None)
+        with self._lock:
+            self._db.execute('DELETE FROM card_files WHERE card_id=?', (card_id,))
+            self._db.executemany(
+                'INSERT INTO card_files(card_id, rel, size, mtime_ns) VALUES (?,?,?,?)',
+                ((card_id, rel, size, mtime) for rel, size, mtime in files),
+            )
+            self._db.execute(
+                'INSERT OR REPLACE INTO cards(card_id, hwm_mtime_ns, last_backup) VALUES (?,?,?)',
+                (card_id, hwm, time.time()),
+            )
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,172 @@
+from __future__ import annotations
+from pathlib import Path
+import errno
+import hashlib
+import os
+import shutil
+from typing import Iterable, List, Optional, Tuple
+
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+# A kernel copy call moves at most this much before we loop again
+_KERNEL_CHUNK = 64 * 1024 * 1024
+# errno values meaning "this kernel path does not work for these files", not I/O errors
+_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.ENOTSOCK}
+
+
+_libc = None
+
+
+def _syncfs(fd: int) -> bool:
+    """syncfs(2) through libc: one call flushes the whole destination filesystem."""
+    global _libc
+    try:
+        if _libc is None:
+            import ctypes
+            import ctypes.util
+            _libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        return _libc.syncfs(fd) == 0
+    except Exception:
+        return False
+
+
+def sync_files(paths: Iterable[Path], drop_cache: bool = True) -> None:
+    """Group-commit a batch of files to disk, then drop their cached pages.
+
+    One syncfs covers the whole batch where available, else each file is
+    fsynced. Afterwards POSIX_FADV_DONTNEED evicts the now-clean pages, so a
+    following verify read really comes from the device, not from RAM.
+    Directories may be passed too, to make renames inside them durable.
+    """
+    fds: List[int] = []
+    try:
+        for p in paths:
+            fds.append(os.open(p, os.O_RDONLY))
+        if not fds:
+            return
+        if not _syncfs(fds[0]):
+            for fd in fds:
+                os.fsync(fd)
+        if drop_cache:
+            for fd in fds:
+                fadvise(fd, 'DONTNEED')
+    finally:
+        for fd in fds:
+            os.close(fd)
+
+
+def fadvise(fd: int, advice_name: str) -> None:
+    """posix_fadvise(fd, 0, 0, POSIX_FADV_<advice_name>) where supported; a hint only."""
+    advice = getattr(os, f'POSIX_FADV_{advice_name}', None)
+    if advice is None or not hasattr(os, 'posix_fadvise'):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, advice)
+    except OSError:
+        pass
+
+
+def _kernel_copy(fin: int, fout: int) -> Optional[int]:
+    """Copy fin to fout inside the kernel. Returns bytes copied, or None if unsupported.
+
+    Tries copy_file_range first, then sendfile. A backend that fails before
+    moving any byte is treated as unsupported; failures mid-copy are raised.
+    """
+    backends = []
+    if hasattr(os, 'copy_file_range'):
+        backends.append(lambda off: os.copy_file_range(fin, fout, _KERNEL_CHUNK, off, off))
+    if hasattr(os, 'sendfile'):
+        backends.append(lambda off: os.sendfile(fout, fin, off, _KERNEL_CHUNK))
+    for step in backends:
+        copied = 0
+        try:
+            while True:
+                n = step(copied)
+                if n == 0:
+                    return copied
+                copied += n
+        except OSError as e:
+            if copied or e.errno not in _UNSUPPORTED:
+                raise
+    return None
+
+
+def copy_file(src: Path, dst: Path, algo: Optional[str] = None, writer=None, block_size: int = DEFAULT_BLOCK_SIZE) -> Tuple[int, Optional[str]]:
+    """Copy src to dst and return (bytes, hex digest of the source stream or None).
+
+    Without hashing or a shared writer the copy runs in the kernel
+    (copy_file_range, then sendfile). Otherwise each block is read once into a
+    reusable buffer with readinto, hashed and written; with a writer the
+    buffers come from its pool and are written by its thread.
+    """
+    with open(src, 'rb', buffering=0) as fin, open(dst, 'wb', buffering=0) as fout:
+        fadvise(fin.fileno(), 'SEQUENTIAL')
+        if algo is None and writer is None:
+            n = _kernel_copy(fin.fileno(), fout.fileno())
+            if n is not None:
+                shutil.copystat(src, dst)
+                return n, None
+            fin.seek(0)
+            fout.seek(0)
+            fout.truncate()
+        h = hashlib.new(algo) if algo else None
+        if writer is None:
+            n = _buffered_copy(fin, fout, h, memoryview(bytearray(block_size)))
+        else:
+            try:
+                n = _queued_copy(fin, fout, h, writer)
+            finally:
+                # Never close fout with writes still queued against it
+                writer.flush(fout)
+    shutil.copystat(src, dst)
+    return n, (h.hexdigest() if h is not None else None)
+
+
+def _buffered_copy(fin, fout, h, buf: memoryview) -> int:
+    n = 0
+    while True:
+        got = fin.readinto(buf)
+        if not got:
+            return n
+        if h is not None:
+            h.update(buf[:got])
+        write_all(fout, buf[:got])
+        n += got
+
+
+def _queued_copy(fin, fout, h, writer) -> int:
+    n = 0
+    while True:
+        buf = writer.acquire()
+        try:
+            got = fin.readinto(buf)
+        except BaseException:
+            writer.release(buf)
+            raise
+        if not got:
+            writer.release(buf)
+            return n
+        if h is not None:
+            h.update(buf[:got])
+        writer.write(fout, buf, got)
+        n += got
+
+
+def hash_file(path: Path, algo: str = 'sha256', block_size: int = DEFAULT_BLOCK_SIZE) -> str:
+    h = hashlib.new(algo)
+    buf = memoryview(bytearray(block_size))
+    with open(path, 'rb', buffering=0) as f:
+        fadvise(f.fileno(), 'SEQUENTIAL')
+        while True:
+            got = f.readinto(buf)
+            if not got:
+                break
+            h.update(buf[:got])
+    return h.hexdigest()
+
+
+def write_all(f, view: memoryview) -> None:
+    # Unbuffered writes may be short
+    while view:
+        n = f.write(view)
+        view = view[n:]
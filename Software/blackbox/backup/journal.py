@@ -0,0 +1,78 @@
+from __future__ import annotations
+from pathlib import Path
+import threading
+from typing import Dict, Iterable, Tuple
+
+from ..state.db import connect
+
+
+PLANNED = 'planned'
+INFLIGHT = 'inflight'
+COMMITTED = 'committed'
+
+
+def part_path(dst: Path) -> Path:
+    """Temporary name a copy is written to before the atomic rename onto dst."""
+    return dst.with_name(f'.{dst.name}.part')
+
+
+class Journal:
+    """Write-ahead journal of a card backup: planned -> inflight -> committed.
+
+    Rows are keyed by (source, file relative to the source). A backup that was
+    interrupted leaves its rows behind; the next run calls ``recover`` to drop
+    half-written ``.part`` files and skips everything already committed.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._db = connect(
+            db_path,
+            'CREATE TABLE IF NOT EXISTS journal ('
+            ' source TEXT NOT NULL, src TEXT NOT NULL, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' dst TEXT, state TEXT NOT NULL, PRIMARY KEY (source, src));',
+        )
+
+    def recover(self, source: str) -> int:
+        """Remove leftovers of in-flight copies for source; return how many were reset."""
+        with self._lock:
+            rows = self._db.execute('SELECT dst FROM journal WHERE source=? AND state=?', (source, INFLIGHT)).fetchall()
+            for (dst,) in rows:
+                if dst:
+                    part_path(Path(dst)).unlink(missing_ok=True)
+            self._db.execute('UPDATE journal SET state=? WHERE source=? AND state=?', (PLANNED, source, INFLIGHT))
+            self._db.commit()
+        return len(rows)
+
+    def plan(self, source: str, files: Iterable[Tuple[str, int, int]]) -> None:
+        """Record (src, size, mtime_ns) as planned; rows from an earlier run are kept."""
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR IGNORE INTO journal(source, src, size, mtime_ns, state) VALUES (?,?,?,?,?)',
+                ((source, s, size, mtime, PLANNED) for s, size, mtime in files),
+            )
+            self._db.commit()
+
+    def committed(self, source: str) -> Dict[str, Tuple[str, int, int]]:
+        """Map src -> (dst, size, mtime_ns) for files already committed from source."""
+        with self._lock:
+            rows = self._db.execute('SELECT src, dst, size, mtime_ns FROM journal WHERE source=? AND state=?', (source, COMMITTED)).fetchall()
+        return {src: (dst, size, mtime) for src, dst, size, mtime in rows}
+
+    def mark(self, source: str, src: str, state: str, dst: Path | None = None) -> None:
+        with self._lock:
+            if dst is not None:
+                self._db.execute('UPDATE journal SET state=?, dst=? WHERE source=? AND src=?', (state, str(dst), source, src))
+            else:
+                self._db.execute('UPDATE journal SET state=? WHERE source=? AND src=?', (state, source, src))
+            self._db.commit()
+
+    def finish(self, source: str) -> None:
+        """Forget source once its backup completed without errors."""
+        with self._lock:
+            self._db.execute('DELETE FROM journal WHERE source=?', (source,))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,87 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import threading
+from typing import Optional, Tuple
+
+from ..state.db import connect
+
+
+@dataclass
+class ManifestEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: Optional[str]
+
+
+class Manifest:
+    """Persistent record of backed-up files: path, size, mtime and SHA256.
+
+    Entries are keyed by path relative to ``base`` (the trips folder) and are
+    only trusted while the file on disk still has the recorded size and mtime,
+    so files deleted or edited outside the app simply fall out of the manifest.
+    """
+
+    def __init__(self, db_path: Path, base: Path):
+        self.base = base
+        self._lock = threading.Lock()
+        self._db = connect(
+            db_path,
+            'CREATE TABLE IF NOT EXISTS files ('
+            ' path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, sha256 TEXT);',
+        )
+
+    def _key(self, path: Path) -> str:
+        try:
+            return path.relative_to(self.base).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def lookup(self, path: Path, st: Optional[os.stat_result] = None) -> Optional[ManifestEntry]:
+        """Return the entry for path if it still matches the file on disk, forgetting it if not.
+
+        Pass st when the caller has just stat'ed path, to save a second stat.
+        """
+        entry, stale = self._match(path, st)
+        if stale:
+            self.forget(path)
+        return entry
+
+    def peek(self, path: Path, st: Optional[os.stat_result] = None) -> Optional[ManifestEntry]:
+        """Like lookup, but leaves a stale entry alone; for readers such as the web UI."""
+        return self._match(path, st)[0]
+
+    def _match(self, path: Path, st: Optional[os.stat_result]) -> Tuple[Optional[ManifestEntry], bool]:
+        key = self._key(path)
+        with self._lock:
+            row = self._db.execute('SELECT size, mtime_ns, sha256 FROM files WHERE path=?', (key,)).fetchone()
+        if row is None:
+            return None, False
+        if st is None:
+            try:
+                st = path.stat()
+            except OSError:
+                st = None
+        if st is None or st.st_size != row[0] or st.st_mtime_ns != row[1]:
+            return None, True
+        return ManifestEntry(key, row[0], row[1], row[2]), False
+
+    def record(self, path: Path, sha256: Optional[str]) -> None:
+        st = path.stat()
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO files(path, size, mtime_ns, sha256) VALUES (?,?,?,?)',
+                (self._key(path), st.st_size, st.st_mtime_ns, sha256),
+            )
+            self._db.commit()
+
+    def forget(self, path: Path) -> None:
+        with self._lock:
+            self._db.execute('DELETE FROM files WHERE path=?', (self._key(path),))
+            self._db.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
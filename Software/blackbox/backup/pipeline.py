@@ -0,0 +1,41 @@
+from __future__ import annotations
+import queue
+import threading
+from typing import Any, Callable
+
+
+class Stage:
+    """One pipeline stage: a worker thread draining a bounded queue.
+
+    ``put`` blocks once ``depth`` items are waiting, which keeps the upstream
+    stage at most that far ahead. ``fn`` must handle its own errors; anything
+    it raises is kept (the first error) and re-raised from ``close``.
+    """
+
+    def __init__(self, fn: Callable[[Any], None], depth: int = 4, name: str = 'stage'):
+        self._fn = fn
+        self._q: queue.Queue = queue.Queue(maxsize=max(1, depth))
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._q.get()
+            if item is None:
+                return
+            try:
+                self._fn(item)
+            except BaseException as e:
+                if self._error is None:
+                    self._error = e
+
+    def put(self, item: Any) -> None:
+        self._q.put(item)
+
+    def close(self) -> None:
+        """Wait for every queued item to be processed."""
+        self._q.put(None)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,193 @@
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+import hashlib
+import shutil
+import time
+from typing import Deque, Dict, List, Optional, Tuple
+
+from ..inventory import PHOTO, MediaEntry
+from ..paths import Paths
+from .manifest import Manifest
+
+
+COPY = 'copy'        # destination missing: new file
+REPLACE = 'replace'  # our card-tagged destination exists with a different size (source changed)
+CHECK = 'check'      # destination exists with the same size: decided by hash at copy time
+SKIP = 'skip'        # already backed up (manifest, journal or card snapshot)
+
+
+class InsufficientSpace(Exception):
+    def __init__(self, needed: int, free: int, min_free: int):
+        super().__init__(f'Need {needed} bytes, {free} free, {min_free} reserved')
+        self.needed = needed
+        self.free = free
+        self.min_free = min_free
+
+
+@dataclass
+class PlannedFile:
+    src: Path
+    rel: str
+    dst: Path
+    size: int
+    mtime_ns: int
+    action: str
+    tagged: bool = False   # dst is the card-tagged name because the plain one holds other content
+
+
+@dataclass
+class BackupPlan:
+    source_root: Path
+    device_label: str
+    files: List[PlannedFile] = field(default_factory=list)
+    work_bytes: int = 0      # bytes still to read after manifest dedup
+    needed_bytes: int = 0    # space the destination must provide while the run is in flight
+    card_id: str = ''        # volume id the journal and card memory are keyed by (see volume_id)
+    sidecars: Dict[Path, List[MediaEntry]] = field(default_factory=dict)  # video src -> LRV/THM/LRF
+
+
+@dataclass
+class Progress:
+    device: str
+    files_done: int
+    files_total: int
+    bytes_done: int
+    bytes_total: int
+    throughput: float = 0.0        # bytes/s over the rolling window
+    eta_s: Optional[float] = None
+
+    @property
+    def fraction(self) -> float:
+        if self.bytes_total:
+            return self.bytes_done / self.bytes_total
+        return self.files_done / self.files_total if self.files_total else 1.0
+
+
+class RateMeter:
+    """Rolling-window throughput estimate used for the ETA."""
+
+    def __init__(self, window_s: float = 30.0):
+        self.window_s = window_s
+        self._samples: Deque[Tuple[float, int]] = deque()
+
+    def add(self, bytes_done: int, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        self._samples.append((now, bytes_done))
+        while len(self._samples) > 2 and now - self._samples[0][0] > self.window_s:
+            self._samples.popleft()
+
+    def rate(self) -> float:
+        if len(self._samples) < 2:
+            return 0.0
+        (t0, b0), (t1, b1) = self._samples[0], self._samples[-1]
+        return (b1 - b0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def eta(self, remaining: int) -> Optional[float]:
+        r = self.rate()
+        return remaining / r if r > 0 else None
+
+
+def tagged_name(dst: Path, card_id: str, rel: str) -> Path:
+    """Destination for a file whose plain name is taken by different content: IMG_1_<tag>.JPG.
+
+    The tag comes from the card and the file's path on it, so every run maps
+    the same source to the same name and dedup keeps working.
+    """
+    tag = hashlib.sha1(f'{card_id}\0{rel}'.encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+    return dst.with_name(f'{dst.stem}_{tag}{dst.suffix}')
+
+
+def _stat(path: Path):
+    try:
+        return path.stat()
+    except OSError:
+        return None
+
+
+def plan_backup(source_root: Path, files: List[MediaEntry], paths: Paths, device_label: str, trust_metadata: bool,
+                manifest: Manifest, committed: Optional[Dict[str, Tuple[str, int, int]]] = None,
+                known: Optional[Dict[str, Tuple[int, int]]] = None, high_water_mark: Optional[int] = None,
+                card_id: str = '') -> BackupPlan:
+    """Decide what each file of a card's inventory needs, without writing anything.
+
+    ``files`` come from one inventory scan with ``rel`` relative to source_root;
+    their cached stat is used, so only destinations are stat'ed here.
+
+    With trust_metadata (verify modes without a full hash) a destination whose
+    manifest entry matches size and mtime is skipped outright. ``known`` is the
+    card's snapshot from its last complete backup: a file at or below the
+    high-water mark that is unchanged in the snapshot is skipped without
+    hashing in every verify mode, provided its destination still matches the
+    manifest too (so an edited or swapped destination is checked again).
+
+    A destination name already holding different content (another card, or
+    another folder of this one) is never overwritten: the file is planned
+    under its card-tagged name instead (see tagged_name). The copy stage
+    checks again, since another card may take a name after planning.
+    """
+    plan = BackupPlan(source_root, device_label, card_id=card_id)
+    committed = committed or {}
+    known = known or {}
+    photos = paths.photos_dir(create=False)
+    for e in files:
+        rel = e.rel
+        if e.kind == PHOTO:
+            dst = photos / e.name
+        else:
+            date_str = time.strftime('%Y-%m-%d', time.localtime(e.mtime))
+            dst = paths.videos_dir(date_str, device_label, create=False) / e.name
+
+        action = COPY
+        tagged = False
+        done = committed.get(rel)
+        newer = high_water_mark is None or e.mtime_ns > high_water_mark
+        if done is not None and done[1:] == (e.size, e.mtime_ns) and Path(done[0]).exists():
+            # Committed by an interrupted run, possibly under the tagged name
+            action, dst = SKIP, Path(done[0])
+        else:
+            dst_st = _stat(dst)
+            dst_size = dst_st.st_size if dst_st is not None else None
+            if dst_size is not None and dst_size != e.size:
+                # The plain name holds other content: keep it, use this card's tagged name
+                dst, tagged = tagged_name(dst, card_id, rel), True
+                dst_st = _stat(dst)
+                dst_size = dst_st.st_size if dst_st is not None else None
+            if dst_size is None:
+                plan.needed_bytes += e.size
+            elif dst_size != e.size:
+                # The new copy is written next to the old one (.part) before replacing it
+                action = REPLACE
+                plan.needed_bytes += e.size
+            else:
+                # Skip without hashing only while the destination is still the file the manifest recorded
+                entry = manifest.lookup(dst, dst_st)
+                recorded = entry is not None and entry.mtime_ns == e.mtime_ns
+                in_snapshot = not newer and known.get(rel) == (e.size, e.mtime_ns)
+                action = SKIP if recorded and (trust_metadata or in_snapshot) else CHECK
+        if action != SKIP:
+            plan.work_bytes += e.size
+        plan.files.append(PlannedFile(e.path, rel, dst, e.size, e.mtime_ns, action, tagged))
+    return plan
+
+
+def add_sidecar_bytes(plan: BackupPlan, exts: Tuple[str, ...]) -> int:
+    """Count the sidecars (with one of ``exts``) of videos to be written into needed_bytes.
+
+    They are staged on the same disk as the backup (see stage_sidecars).
+    Returns the bytes added.
+    """
+    n = sum(e.size for f in plan.files if f.action != SKIP for e in plan.sidecars.get(f.src, ())
+            if e.path.suffix.lower() in exts)
+    plan.needed_bytes += n
+    return n
+
+
+def check_space(plans: List[BackupPlan], paths: Paths, min_free_gb: float) -> None:
+    """Raise InsufficientSpace unless all plans fit while keeping min_free_gb free."""
+    min_free = int(min_free_gb * 1_000_000_000)
+    free = shutil.disk_usage(str(paths.nvme_mount)).free
+    needed = sum(p.needed_bytes for p in plans)
+    if free - needed < min_free:
+        raise InsufficientSpace(needed, free, min_free)
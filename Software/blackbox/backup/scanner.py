@@ -1,7 +1,10 @@
 from __future__ import annotations
 from pathlib import Path
-from typing import Iterable, Optional
+from typing import Callable, Iterable, Optional
 import os
+import re
+import select
+import threading
 
 
 DCIM_NAMES = {"DCIM", "dcim"}
@@ -51,3 +54,135 @@ def classify_device_code(root: Path) -> str:
     if any(s in name for s in ('lumix', 'panasonic', 'g7')):
         return 'lumix_g7'
     return 'camera'
+
+
+MOUNTINFO = '/proc/self/mountinfo'
+
+
+def _unescape(field: str) -> str:
+    # mountinfo escapes space, tab, newline and backslash as \ooo
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), field)
+
+
+def parse_mountinfo(text: str) -> list[tuple[str, str, str]]:
+    """Return (mount_point, fstype, source) for each line of /proc/self/mountinfo."""
+    out = []
+    for line in text.splitlines():
+        parts = line.split()
+        try:
+            sep = parts.index('-')
+            out.append((_unescape(parts[4]), parts[sep + 1], _unescape(parts[sep + 2])))
+        except (ValueError, IndexError):
+            continue
+    return out
+
+
+def _has_dcim(mount: Path) -> bool:
+    return any((mount / dn).is_dir() for dn in DCIM_NAMES)
+
+
+class MountWatcher:
+    """Keep a live table of DCIM sources under the configured roots.
+
+    Waits on /proc/self/mountinfo with poll(), where the kernel signals every
+    mount table change (no udev needed), and only inspects mounts that are new.
+    Each refresh also runs find_dcim_mounts, so DCIM folders one level below a
+    root that are not mount points of their own (a reader mounted at the root,
+    a dev folder) count too; those are noticed at start and on the next mount
+    change. Where mountinfo is unavailable (dev machines) find_dcim_mounts
+    runs every ``fallback_interval_s`` instead.
+
+    Changes are reported through on_added/on_removed and published on the bus
+    as 'card.added'/'card.removed'. Sources already present at start are in
+    sources() but not reported as added, so backup.auto_start only reacts to
+    cards inserted while running, not to the ones left in at boot.
+    """
+
+    def __init__(self, source_roots: Iterable[str], on_added: Optional[Callable[[Path], None]] = None,
+                 on_removed: Optional[Callable[[Path], None]] = None, bus=None,
+                 mountinfo: str = MOUNTINFO, fallback_interval_s: float = 3.0):
+        self.source_roots = [Path(r) for r in source_roots]
+        self.on_added = on_added
+        self.on_removed = on_removed
+        self.bus = bus
+        self.mountinfo = mountinfo
+        self.fallback_interval_s = fallback_interval_s
+        self._lock = threading.Lock()
+        self._mounts: set[Path] = set()      # every mount under a source root
+        self._sources: list[Path] = []       # the ones with a DCIM folder, in mount order
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='mount-watcher', daemon=True)
+
+    def sources(self) -> list[Path]:
+        with self._lock:
+            return list(self._sources)
+
+    def start(self) -> 'MountWatcher':
+        self.refresh(notify=False)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _under_roots(self, mount: Path) -> bool:
+        return any(mount != r and r in mount.parents for r in self.source_roots)
+
+    def refresh(self, notify: bool = True) -> None:
+        folders = set(find_dcim_mounts(str(r) for r in self.source_roots))
+        try:
+            with open(self.mountinfo, 'r', encoding='utf-8', errors='replace') as f:
+                mounts = {Path(mp) for mp, _, _ in parse_mountinfo(f.read())}
+            mounts = {m for m in mounts if self._under_roots(m)}
+        except OSError:
+            mounts = set()
+        with self._lock:
+            added = mounts - self._mounts
+            self._mounts = mounts
+            before = list(self._sources)
+            current = folders | {s for s in before if s in mounts} | {m for m in added if _has_dcim(m)}
+            self._sources = [s for s in before if s in current] + sorted(current.difference(before))
+        if not notify:
+            return
+        for s in self._sources:
+            if s not in before:
+                self._notify('card.added', self.on_added, s)
+        for s in before:
+            if s not in self._sources:
+                self._notify('card.removed', self.on_removed, s)
+
+    def _notify(self, topic: str, cb, mount: Path) -> None:
+        if self.bus is not None:
+            self.bus.publish(topic, mount)
+        if cb is not None:
+            try:
+                cb(mount)
+            except Exception:
+                pass
+
+    def _refresh_logged(self) -> None:
+        # A card pulled mid-refresh must not end the watcher: report it and try again on the next change
+        try:
+            self.refresh()
+        except Exception as e:
+            print("[MountWatcher] refresh failed:", e)
+
+    def _run(self) -> None:
+        try:
+            f = open(self.mountinfo, 'rb')
+        except OSError:
+            while not self._stop.wait(self.fallback_interval_s):
+                self._refresh_logged()
+            return
+        with f:
+            poller = select.poll()
+            poller.register(f.fileno(), select.POLLPRI | select.POLLERR)
+            f.read()
+            while not self._stop.is_set():
+                if not poller.poll(1000):
+                    continue
+                # Re-read to re-arm the notification, then diff the table
+                f.seek(0)
+                f.read()
+                self._refresh_logged()
@@ -0,0 +1,135 @@
+from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+
+from ..paths import Paths
+from ..config import get_config
+from ..events import EventBus
+from ..hardware.power import PowerMonitor, Throttle
+from ..inventory import entry_for
+from ..mediaindex import MediaIndex
+from .backup import CopyResult, PathLocks, WriteQueue, copy_from_source, device_label_for, get_verifier, prepare_backup
+from .manifest import Manifest
+from .journal import Journal
+from .cards import CardStore
+from .planner import BackupPlan, Progress, check_space
+
+
+def _device_key(source_root: Path) -> int:
+    try:
+        return os.stat(source_root).st_dev
+    except OSError:
+        return hash(str(source_root))
+
+
+def group_by_device(sources: List[Path]) -> List[List[Path]]:
+    """Group mounts living on the same block device; one reader per group."""
+    groups: Dict[int, List[Path]] = {}
+    for s in sources:
+        groups.setdefault(_device_key(s), []).append(s)
+    return list(groups.values())
+
+
+def backup_sources(sources: List[Path], paths: Paths, verify_mode: str = 'fast', progress_cb: Optional[Callable[[Progress], None]] = None,
+                   bus: Optional[EventBus] = None, power: Optional[PowerMonitor] = None) -> List[CopyResult]:
+    """Back up several cards at once and return one CopyResult per source, in order.
+
+    All cards are planned first and rejected together with InsufficientSpace
+    before anything is written. Each source device then gets its own reader
+    thread; all of them feed a single bounded NVMe write queue (a lone card
+    that needs no hashing copies in the kernel instead). progress_cb
+    receives a Progress summed over all cards, which is also published on bus
+    as 'backup.progress' (publishing never blocks the copy threads). With a
+    power monitor, only one card reads at a time while the Pi is throttled
+    and none while it is undervolted; each resumes at the next file.
+    """
+    cfg = get_config()
+    # A trip renamed in the settings mid-run must not split a card across two folders
+    paths = paths.frozen()
+    depth = int(cfg.get('backup', {}).get('write_queue_chunks', 32))
+    min_free_gb = float(cfg.get('limits', {}).get('min_free_gb', 10))
+    block_size = int(cfg.get('backup', {}).get('block_size_kb', 1024)) * 1024
+    locks = PathLocks()
+    manifest = Manifest(paths.manifest_db, paths.trips)
+    journal = Journal(paths.journal_db)
+    cards = CardStore(paths.cards_db)
+    plans: Dict[Path, BackupPlan] = {}
+    progress: Dict[Path, Progress] = {}
+    progress_lock = threading.Lock()
+    results: Dict[Path, CopyResult] = {}
+
+    def _failed(src: Path, e: Exception) -> CopyResult:
+        return CopyResult(0, 0, 0, 0, device_label_for(src, cfg), [f'Error copying {src}: {e}'])
+
+    def _card_cb(src: Path) -> Callable[[Progress], None]:
+        def cb(p: Progress) -> None:
+            with progress_lock:
+                progress[src] = p
+                total = _combine(list(progress.values()))
+            if bus is not None:
+                bus.publish('backup.progress', total)
+            if progress_cb:
+                progress_cb(total)
+        return cb
+
+    def _planner(group: List[Path]) -> None:
+        for src in group:
+            try:
+                plans[src] = prepare_backup(src, paths, verify_mode, manifest, journal, cards)
+            except Exception as e:
+                results[src] = _failed(src, e)
+
+    def _reader(group: List[Path]) -> None:
+        for src in group:
+            if src not in plans:
+                continue
+            try:
+                results[src] = copy_from_source(src, paths, verify_mode=verify_mode, progress_cb=_card_cb(src), writer=writer, locks=locks,
+                                                manifest=manifest, journal=journal, plan=plans[src], cards=cards,
+                                                throttle=throttle)
+            except Exception as e:
+                results[src] = _failed(src, e)
+
+    groups = group_by_device(sources)
+    throttle = Throttle(power, len(groups)) if power is not None else None
+    writer = None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(groups)), thread_name_prefix='card-reader') as pool:
+            list(pool.map(_planner, groups))
+            check_space(list(plans.values()), paths, min_free_gb)
+            if len(groups) > 1 or get_verifier(verify_mode, cfg).stream_algo is not None:
+                writer = WriteQueue(depth, block_size)
+            list(pool.map(_reader, groups))
+    finally:
+        if writer is not None:
+            writer.close()
+        manifest.close()
+        journal.close()
+        cards.close()
+    # The web UI lists from the media index: make the new files show up right away
+    trip = paths.trip_root()
+    written = (entry_for(dst, trip) for r in results.values() for dst in r.written)
+    index = MediaIndex(paths.media_db)
+    try:
+        index.add(trip.name, (e for e in written if e is not None))
+    finally:
+        index.close()
+    return [results[s] for s in sources]
+
+
+def _combine(parts: List[Progress]) -> Progress:
+    bytes_done = sum(p.bytes_done for p in parts)
+    bytes_total = sum(p.bytes_total for p in parts)
+    rate = sum(p.throughput for p in parts)
+    return Progress(
+        device=', '.join(p.device for p in parts),
+        files_done=sum(p.files_done for p in parts),
+        files_total=sum(p.files_total for p in parts),
+        bytes_done=bytes_done,
+        bytes_total=bytes_total,
+        throughput=rate,
+        eta_s=(bytes_total - bytes_done) / rate if rate > 0 else None,
+    )
@@ -1,14 +1,30 @@
+import copy
 import os
 from pathlib import Path
+import threading
+import time
 import yaml
 
 
 DEFAULT_CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config.default.yml'
 USER_CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config.yml'
 
+# The files are stat'ed for changes at most this often; saves in this process apply at once
+CHECK_INTERVAL_S = 1.0
 
-def load_config() -> dict:
-    """Load config.yml, falling back to defaults, and write a merged copy on first run."""
+_lock = threading.Lock()
+_cached: dict = {'cfg': None, 'stamp': None, 'checked': float('-inf'), 'version': 0}
+
+
+def _mtime(path: Path):
+    try:
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+
+def _read() -> dict:
     with open(DEFAULT_CONFIG_PATH, 'r', encoding='utf-8') as f:
         default = yaml.safe_load(f) or {}
     if USER_CONFIG_PATH.exists():
@@ -20,17 +36,60 @@ def load_config() -> dict:
     # ensure user config exists for easy editing
     if not USER_CONFIG_PATH.exists():
         try:
-            with open(USER_CONFIG_PATH, 'w', encoding='utf-8') as f:
-                yaml.safe_dump(cfg, f, sort_keys=False)
+            _write(cfg)
         except Exception:
             pass
     return cfg
 
 
-def save_config(cfg: dict) -> None:
+def get_config() -> dict:
+    """The parsed config, shared and cached; re-read when either file's mtime changes.
+
+    Treat the result as read-only (use load_config() for a copy to edit). In
+    another process, a save shows up within CHECK_INTERVAL_S.
+    """
+    with _lock:
+        now = time.monotonic()
+        if _cached['cfg'] is not None and now - _cached['checked'] < CHECK_INTERVAL_S:
+            return _cached['cfg']
+        _cached['checked'] = now
+        stamp = (_mtime(DEFAULT_CONFIG_PATH), _mtime(USER_CONFIG_PATH))
+        if _cached['cfg'] is None or stamp != _cached['stamp']:
+            _cached['cfg'] = _read()
+            # Stamp after reading: creating config.yml on first run must not trigger a reload
+            _cached['stamp'] = (_mtime(DEFAULT_CONFIG_PATH), _mtime(USER_CONFIG_PATH))
+            _cached['version'] += 1
+        return _cached['cfg']
+
+
+def config_version() -> int:
+    """Counter bumped whenever the cached config is replaced; cheap change detection."""
+    get_config()
+    return _cached['version']
+
+
+def load_config() -> dict:
+    """Load config.yml, falling back to defaults, and write a merged copy on first run.
+
+    Returns a private copy of the cached config that the caller may modify.
+    """
+    return copy.deepcopy(get_config())
+
+
+def _write(cfg: dict) -> None:
     USER_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with open(USER_CONFIG_PATH, 'w', encoding='utf-8') as f:
+    # Write and rename, so another process never parses a half-written file
+    tmp = USER_CONFIG_PATH.with_name(f'.{USER_CONFIG_PATH.name}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
         yaml.safe_dump(cfg, f, sort_keys=False)
+    os.replace(tmp, USER_CONFIG_PATH)
+
+
+def save_config(cfg: dict) -> None:
+    _write(cfg)
+    with _lock:
+        # Re-read (and re-merge with the defaults) on the next access
+        _cached['cfg'] = None
 
 
 def _merge(base: dict, override: dict) -> dict:
@@ -41,4 +100,3 @@ def _merge(base: dict, override: dict) -> dict:
         else:
             out[k] = v
     return out
-
@@ -0,0 +1,68 @@
+from __future__ import annotations
+from collections import deque
+from dataclasses import dataclass
+import threading
+import time
+from typing import Any, Deque, List, Optional
+
+
+@dataclass
+class Event:
+    topic: str
+    payload: Any
+    ts: float
+
+
+class Subscription:
+    """Bounded mailbox of one subscriber; the oldest events are dropped when full."""
+
+    def __init__(self, topics: Optional[set[str]], maxlen: int):
+        self.topics = topics
+        self._events: Deque[Event] = deque(maxlen=maxlen)
+        self._cond = threading.Condition()
+
+    def _offer(self, ev: Event) -> None:
+        if self.topics is not None and ev.topic not in self.topics:
+            return
+        with self._cond:
+            self._events.append(ev)
+            self._cond.notify_all()
+
+    def drain(self, timeout: Optional[float] = None) -> List[Event]:
+        """Return all pending events, waiting up to timeout for the first one."""
+        with self._cond:
+            if not self._events and timeout != 0:
+                self._cond.wait(timeout)
+            out = list(self._events)
+            self._events.clear()
+        return out
+
+
+class EventBus:
+    """In-process publish/subscribe. ``publish`` never blocks on subscribers."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: List[Subscription] = []
+
+    def subscribe(self, *topics: str, maxlen: int = 256) -> Subscription:
+        sub = Subscription(set(topics) or None, maxlen)
+        with self._lock:
+            self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def publish(self, topic: str, payload: Any = None) -> None:
+        ev = Event(topic, payload, time.monotonic())
+        with self._lock:
+            subs = list(self._subs)
+        for s in subs:
+            s._offer(ev)
+
+
+# Process-wide bus shared by the backup engine and UI consumers
+bus = EventBus()
@@ -1,20 +1,270 @@
 from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import glob
 import subprocess
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
 
+from ..events import EventBus
 
-def is_undervoltage() -> bool:
-    """Return True if Pi reports undervoltage via vcgencmd.
 
-    When vcgencmd is unavailable (dev), return False.
+# get_throttled bits for the current state; bits 16-19 ("has occurred") are ignored
+UNDERVOLTAGE = 0x1
+FREQ_CAPPED = 0x2
+THROTTLED = 0x4
+SOFT_TEMP_LIMIT = 0x8
+NOW_MASK = 0xF
+
+# Levels, from least to most constrained
+OK = 'ok'            # full speed
+REDUCED = 'reduced'  # clocks capped or running hot: shrink concurrency
+PAUSED = 'paused'    # undervoltage or critical temperature: start nothing new
+_RANK = {OK: 0, REDUCED: 1, PAUSED: 2}
+
+THROTTLED_NODES = (
+    '/sys/devices/platform/soc/soc:firmware/get_throttled',
+    '/sys/devices/platform/*/*:firmware/get_throttled',
+    '/sys/devices/platform/*firmware*/get_throttled',
+)
+THERMAL_ZONE = Path('/sys/class/thermal/thermal_zone0/temp')
+
+Reading = Tuple[Optional[int], Optional[float]]  # (get_throttled bits, SoC temperature in C)
+
+
+def _parse_throttled(text: str) -> int:
+    # vcgencmd prints "throttled=0x50005", the sysfs node just the hex digits
+    return int(text.strip().rpartition('=')[2], 16)
+
+
+class VcgencmdSource:
+    """get_throttled via vcgencmd, run at most once every ``min_interval_s``."""
+
+    def __init__(self, min_interval_s: float = 10.0):
+        self.min_interval_s = min_interval_s
+        self._last: Optional[int] = None
+        self._at = float('-inf')
+
+    def throttled(self) -> Optional[int]:
+        now = time.monotonic()
+        if now - self._at >= self.min_interval_s:
+            self._at = now
+            try:
+                self._last = _parse_throttled(subprocess.check_output(['vcgencmd', 'get_throttled'], text=True, timeout=5))
+            except Exception:
+                self._last = None
+        return self._last
+
+    def read(self) -> Reading:
+        return self.throttled(), None
+
+
+class SysfsSource:
+    """Throttle bits and SoC temperature read from sysfs, without spawning anything.
+
+    Kernels without the firmware's get_throttled node fall back to a cached
+    vcgencmd call for the bits. Either half may be None (e.g. not on a Pi).
     """
-    try:
-        out = subprocess.check_output(['vcgencmd', 'get_throttled'], text=True)
-        # output like: throttled=0x0 or 0x50000 etc.
-        if '0x0' in out:
-            return False
-        # Bit 0 (undervoltage now) or 16 (has happened) -> warn, treat as low power if bit0 set
-        val = int(out.strip().split('=')[1], 16)
-        return bool(val & 0x1)
-    except Exception:
-        return False
 
+    def __init__(self, fallback: Optional[VcgencmdSource] = None):
+        nodes = [p for pattern in THROTTLED_NODES for p in sorted(glob.glob(pattern))]
+        self.node = Path(nodes[0]) if nodes else None
+        self.fallback = fallback if fallback is not None else VcgencmdSource()
+
+    def read(self) -> Reading:
+        bits: Optional[int] = None
+        if self.node is not None:
+            try:
+                bits = _parse_throttled(self.node.read_text())
+            except (OSError, ValueError):
+                bits = None
+        if bits is None:
+            bits = self.fallback.throttled()
+        try:
+            temp: Optional[float] = int(THERMAL_ZONE.read_text()) / 1000.0
+        except (OSError, ValueError):
+            temp = None
+        return bits, temp
+
+
+class FakeSource:
+    """Stand-in source for development and tests; ``set`` changes what the monitor sees."""
+
+    def __init__(self, throttled: int = 0, temp_c: Optional[float] = 45.0):
+        self._reading: Reading = (throttled, temp_c)
+
+    def set(self, throttled: int = 0, temp_c: Optional[float] = 45.0) -> None:
+        self._reading = (throttled, temp_c)
+
+    def read(self) -> Reading:
+        return self._reading
+
+
+@dataclass(frozen=True)
+class PowerState:
+    level: str = OK
+    throttled: int = 0               # current-state get_throttled bits
+    temp_c: Optional[float] = None
+
+    @property
+    def undervoltage(self) -> bool:
+        return bool(self.throttled & UNDERVOLTAGE)
+
+
+class PowerMonitor:
+    """Polls power and thermal state and turns it into a level for background work.
+
+    Undervoltage or ``critical_c`` pause new work; capped clocks, throttling,
+    the soft temperature limit or ``hot_c`` reduce it. Getting more constrained
+    applies at once, relaxing only after the condition stayed clear for
+    ``resume_after_s``, so a flickering supply does not make the load
+    oscillate. Changes are published on bus as 'power.state' and passed to
+    listeners (called from the monitor thread).
+    """
+
+    def __init__(self, source=None, bus: Optional[EventBus] = None, interval_s: float = 2.0, hot_c: float = 75.0,
+                 critical_c: float = 82.0, resume_after_s: float = 10.0):
+        self.source = source if source is not None else SysfsSource()
+        self.bus = bus
+        self.interval_s = interval_s
+        self.hot_c = hot_c
+        self.critical_c = critical_c
+        self.resume_after_s = resume_after_s
+        self.cond = threading.Condition()
+        self._state = PowerState()
+        self._clear_since: Optional[float] = None
+        self._listeners: List[Callable[[PowerState], None]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def state(self) -> PowerState:
+        return self._state
+
+    @property
+    def level(self) -> str:
+        return self._state.level
+
+    def listen(self, fn: Callable[[PowerState], None]) -> None:
+        self._listeners.append(fn)
+
+    def unlisten(self, fn: Callable[[PowerState], None]) -> None:
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def classify(self, bits: Optional[int], temp_c: Optional[float]) -> str:
+        bits = (bits or 0) & NOW_MASK
+        if bits & UNDERVOLTAGE or (temp_c is not None and temp_c >= self.critical_c):
+            return PAUSED
+        if bits or (temp_c is not None and temp_c >= self.hot_c):
+            return REDUCED
+        return OK
+
+    def poll(self) -> PowerState:
+        """Take one reading and update the level; the monitor thread calls this every interval_s."""
+        try:
+            bits, temp = self.source.read()
+        except Exception:
+            bits, temp = None, None
+        wanted = self.classify(bits, temp)
+        now = time.monotonic()
+        with self.cond:
+            level = self._state.level
+            if _RANK[wanted] >= _RANK[level]:
+                self._clear_since = None
+                level = wanted
+            elif self._clear_since is None:
+                self._clear_since = now
+            elif now - self._clear_since >= self.resume_after_s:
+                self._clear_since = None
+                level = wanted
+            old, self._state = self._state, PowerState(level, (bits or 0) & NOW_MASK, temp)
+            if level != old.level:
+                self.cond.notify_all()
+        if level != old.level:
+            for fn in list(self._listeners):
+                fn(self._state)
+            if self.bus is not None:
+                self.bus.publish('power.state', self._state)
+        return self._state
+
+    def wait_until(self, level: str, timeout: Optional[float] = None) -> bool:
+        """Wait until the level is at most as constrained as ``level``."""
+        with self.cond:
+            return self.cond.wait_for(lambda: _RANK[self._state.level] <= _RANK[level], timeout)
+
+    def start(self) -> 'PowerMonitor':
+        self.poll()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='power-monitor', daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            self.poll()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class Throttle:
+    """Concurrency limit that follows the power level.
+
+    ``full`` slots at OK, ``reduced`` while REDUCED and none while PAUSED;
+    without a monitor it is a plain limit of ``full``. Work already holding a
+    slot is not interrupted, so callers take one per file or per job.
+    """
+
+    def __init__(self, monitor: Optional[PowerMonitor], full: int, reduced: int = 1):
+        self.monitor = monitor
+        self.full = max(1, full)
+        self.reduced = max(1, min(reduced, self.full))
+        self._cond = monitor.cond if monitor is not None else threading.Condition()
+        self._active = 0
+
+    def capacity(self) -> int:
+        level = self.monitor.level if self.monitor is not None else OK
+        return {OK: self.full, REDUCED: self.reduced}.get(level, 0)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        with self._cond:
+            while self._active >= self.capacity():
+                if not blocking:
+                    return False
+                # The monitor notifies on level changes; the timeout covers a stopped monitor
+                self._cond.wait(5.0)
+            self._active += 1
+            return True
+
+    def release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def __enter__(self) -> 'Throttle':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+def default_source(dev_mode: bool = False):
+    return FakeSource() if dev_mode else SysfsSource()
+
+
+def monitor_from_config(cfg: dict, bus: Optional[EventBus] = None, dev_mode: bool = False) -> PowerMonitor:
+    """A (not yet started) PowerMonitor configured from ``hardware.power``."""
+    pcfg = cfg.get('hardware', {}).get('power', {}) or {}
+    return PowerMonitor(
+        default_source(dev_mode), bus,
+        interval_s=float(pcfg.get('poll_interval_s', 2)),
+        hot_c=float(pcfg.get('hot_c', 75)),
+        critical_c=float(pcfg.get('critical_c', 82)),
+        resume_after_s=float(pcfg.get('resume_after_s', 10)),
+    )
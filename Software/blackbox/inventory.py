@@ -0,0 +1,114 @@
+from __future__ import annotations
+from dataclasses import dataclass
+from pathlib import Path
+import os
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+
+PHOTO = 'photo'
+VIDEO = 'video'
+SIDECAR = 'sidecar'   # camera-made low-res companions of a video (GoPro LRV/THM, DJI LRF)
+
+PHOTO_EXTS = frozenset({'.jpg', '.jpeg', '.png', '.rw2', '.cr2', '.nef', '.raf', '.dng', '.arw'})
+VIDEO_EXTS = frozenset({'.mp4', '.mov', '.m4v'})
+SIDECAR_EXTS = frozenset({'.lrv', '.thm', '.lrf'})
+_KINDS = {**{e: PHOTO for e in PHOTO_EXTS}, **{e: VIDEO for e in VIDEO_EXTS}, **{e: SIDECAR for e in SIDECAR_EXTS}}
+
+
+def media_kind(name: str) -> Optional[str]:
+    """PHOTO, VIDEO, SIDECAR or None, from the file name's extension."""
+    return _KINDS.get(os.path.splitext(name)[1].lower())
+
+
+@dataclass
+class MediaEntry:
+    """One media file as seen by a scan, with the stat taken during the walk."""
+    path: Path
+    rel: str          # posix path relative to the scan's rel_to
+    kind: str
+    size: int
+    mtime_ns: int
+
+    @property
+    def name(self) -> str:
+        return self.path.name
+
+    @property
+    def mtime(self) -> float:
+        return self.mtime_ns / 1e9
+
+
+def entry_for(path: Path, rel_to: Path) -> Optional[MediaEntry]:
+    """MediaEntry for one known file, or None if it is not media or is gone."""
+    kind = media_kind(path.name)
+    if kind is None:
+        return None
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return MediaEntry(path, os.path.relpath(path, rel_to).replace(os.sep, '/'), kind, st.st_size, st.st_mtime_ns)
+
+
+def scan(root: Path, kinds: Optional[Iterable[str]] = None, rel_to: Optional[Path] = None,
+         where: Optional[Callable[[MediaEntry], bool]] = None) -> Iterator[MediaEntry]:
+    """Walk root once with os.scandir and yield its media files.
+
+    Each file is stat'ed at most once, and only if its extension is a media
+    type in ``kinds`` (default: photos and videos). Hidden files and folders (dot names, e.g.
+    ``.part`` copies or macOS ``._`` resource forks) are skipped, symlinks are
+    not followed. ``where`` filters the entries further. Order is directory
+    order, not sorted.
+    """
+    wanted = set(kinds) if kinds is not None else {PHOTO, VIDEO}
+    base = str(rel_to if rel_to is not None else root)
+    stack = [str(root)]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except OSError:
+            continue
+        with it:
+            for de in it:
+                if de.name.startswith('.'):
+                    continue
+                try:
+                    if de.is_dir(follow_symlinks=False):
+                        stack.append(de.path)
+                        continue
+                    kind = media_kind(de.name)
+                    if kind not in wanted or not de.is_file(follow_symlinks=False):
+                        continue
+                    st = de.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                entry = MediaEntry(Path(de.path), os.path.relpath(de.path, base).replace(os.sep, '/'), kind,
+                                   st.st_size, st.st_mtime_ns)
+                if where is None or where(entry):
+                    yield entry
+
+
+
+def _master_stems(stem: str) -> List[str]:
+    # GoPro HERO6+ names the low-res copy GL<nn><clip> next to GX/GH<nn><clip>.MP4;
+    # older GoPro (GOPR/GP) and DJI reuse the master's stem
+    stem = stem.upper()
+    if stem.startswith('GL'):
+        return ['GX' + stem[2:], 'GH' + stem[2:]]
+    return [stem]
+
+
+def pair_sidecars(entries: Iterable[MediaEntry]) -> Dict[Path, List[MediaEntry]]:
+    """Map each video's path to the sidecars found next to it (unpaired sidecars are dropped)."""
+    entries = list(entries)
+    videos = {(e.path.parent, e.path.stem.upper()): e.path for e in entries if e.kind == VIDEO}
+    pairs: Dict[Path, List[MediaEntry]] = {}
+    for e in entries:
+        if e.kind != SIDECAR:
+            continue
+        for stem in _master_stems(e.path.stem):
+            master = videos.get((e.path.parent, stem))
+            if master is not None:
+                pairs.setdefault(master, []).append(e)
+                break
+    return pairs
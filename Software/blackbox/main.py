@@ -1,17 +1,23 @@
 from __future__ import annotations
 from pathlib import Path
-import time
+import threading
 import psutil
 
 from .config import load_config
 from .paths import Paths
 from .hardware.display import get_waveshare_display, MockDisplay
 from .ui.screens import HomeScreen, InfoScreen, BackupScreen, VerifyScreen, DoneScreen, APConfirmScreen, APEnabledScreen, SettingsScreen, ErrorScreen, SettingsConfirmScreen
-from .backup.scanner import find_first_dcim, find_dcim_mounts
-from .backup.backup import copy_from_source
-from .proxies.generate import generate_for_folder
+from .backup.scanner import MountWatcher
+from .backup.scheduler import backup_sources
+from .backup.planner import InsufficientSpace
+from .backup.backup import VERIFY_MODES
+from .proxies.generate import pending_jobs
+from .proxies.jobqueue import ProxyQueue
+from .inventory import entry_for
 from .hardware.buttons import Buttons
-from .hardware.power import is_undervoltage
+from .events import bus
+from .ui.progress import ProgressDisplay
+from .hardware.power import PAUSED, REDUCED, monitor_from_config
 from .ap_mode import start_ap, stop_ap, get_ap_address
 
 
@@ -19,11 +25,21 @@ def bytes_to_gb(n: int) -> str:
     return f"{n/1_000_000_000:.0f}gb"
 
 
+def previews_status(jobs: dict) -> str:
+    left = jobs['pending'] + jobs['running']
+    return f"{left} queued" if left else 'up to date'
+
+
 def render_and_push(disp, screen):
     img = screen.draw()
     disp.render(img)
 
 
+def _next_verify_mode(mode: str) -> str:
+    i = VERIFY_MODES.index(mode) if mode in VERIFY_MODES else -1
+    return VERIFY_MODES[(i + 1) % len(VERIFY_MODES)]
+
+
 def run_settings_flow(disp, cfg, buttons: Buttons, dev_mode: bool = False):
     idx = 0
     verify = cfg['verify']['default_mode']
@@ -33,7 +49,7 @@ def run_settings_flow(disp, cfg, buttons: Buttons, dev_mode: bool = False):
     render_and_push(disp, SettingsScreen(disp.width, disp.height, verify, power_off, tone, selected=idx))
     if dev_mode:
         # Toggle verify and save in dev mode (no GPIO)
-        verify = 'sha256' if verify == 'fast' else 'fast'
+        verify = _next_verify_mode(verify)
         cfg['verify']['default_mode'] = verify
         from .config import save_config
         save_config(cfg)
@@ -52,7 +68,7 @@ def run_settings_flow(disp, cfg, buttons: Buttons, dev_mode: bool = False):
         if st[2] and not last[2]:
             # toggle
             if idx == 0:
-                verify = 'sha256' if verify == 'fast' else 'fast'
+                verify = _next_verify_mode(verify)
             elif idx == 1:
                 power_off = {'info':'weather','weather':'clear','clear':'info'}[power_off]
             else:
@@ -90,12 +106,16 @@ def _wait_for_home(buttons: Buttons, dev_mode: bool):
         _t.sleep(0.05)
 
 
-def _menu_select(disp, buttons: Buttons, sel: int, dev_mode: bool) -> int:
+def _menu_select(disp, buttons: Buttons, sel: int, dev_mode: bool, card_inserted: threading.Event | None = None) -> int:
     if dev_mode:
         return sel
     import time as _t
     last_state = [False, False, False, False]
     while True:
+        if card_inserted is not None and card_inserted.is_set():
+            # backup.auto_start: a card appeared while on the home screen
+            card_inserted.clear()
+            return 0
         st = buttons.read() or [False, False, False, False]
         if st[0] and not last_state[0]:
             sel = (sel - 1) % 4
@@ -111,28 +131,37 @@ def _menu_select(disp, buttons: Buttons, sel: int, dev_mode: bool) -> int:
 
 def run(dev_mode: bool = True):
     cfg = load_config()
-    paths = Paths(cfg).ensure()
+    # Follows the live config: a trip renamed in the web settings applies without a restart
+    paths = Paths().ensure()
     disp = MockDisplay() if dev_mode else get_waveshare_display()
     buttons = Buttons(pins=cfg.get('hardware',{}).get('buttons',[5,6,13,19]), dev_mode=dev_mode)
 
+    # Track inserted cards in the background so the backup never has to scan for them
+    card_inserted = threading.Event() if cfg.get('backup', {}).get('auto_start', False) else None
+    watcher = MountWatcher(
+        cfg['paths']['source_roots'],
+        on_added=(lambda _m: card_inserted.set()) if card_inserted is not None else None,
+        bus=bus,
+    ).start()
+    # Throttling/thermal state, polled cheaply in the background and shared with the backup
+    power = monitor_from_config(cfg, bus, dev_mode).start()
+
     while True:
+        # Pick up settings saved from the web UI since the last round (cached, re-read on change)
+        cfg = load_config()
         # Home menu
         sel = 0
         render_and_push(disp, HomeScreen(disp.width, disp.height, selected=sel))
-        sel = _menu_select(disp, buttons, sel, dev_mode)
+        sel = _menu_select(disp, buttons, sel, dev_mode, card_inserted)
 
         if sel == 0:
-            # Manual backup flow (single source only)
-            matches = find_dcim_mounts(cfg['paths']['source_roots'])
+            # Manual backup flow: every inserted card is backed up concurrently
+            matches = watcher.sources()
             if not matches:
                 render_and_push(disp, ErrorScreen(disp.width, disp.height, 'Please insert SD card to continue'))
                 _wait_for_home(buttons, dev_mode)
                 continue
-            if len(matches) > 1:
-                render_and_push(disp, ErrorScreen(disp.width, disp.height, '2 cards detected! Remove one'))
-                _wait_for_home(buttons, dev_mode)
-                continue
-            src = matches[0]
+            src_str = ', '.join(str(m) for m in matches)
 
             # Backup screen
             remaining = psutil.disk_usage(str(paths.nvme_mount)).free
@@ -142,7 +171,7 @@ def run(dev_mode: bool = True):
                     disp.width,
                     disp.height,
                     device_label='device',
-                    copying_from=str(src),
+                    copying_from=src_str,
                     copying_to=str(paths.trip_root()),
                     eta_min=None,
                     remaining_str=f"{bytes_to_gb(remaining)} free",
@@ -150,49 +179,70 @@ def run(dev_mode: bool = True):
                 ),
             )
 
-            # Do copy with progress callback updating the bar
-            total_seen = {'total': 1, 'i': 0}
-
-            def progress_cb(i, total):
-                total_seen['i'] = i
-                total_seen['total'] = max(total_seen['total'], total)
-                frac = i / float(total_seen['total']) if total_seen['total'] else 0
-                render_and_push(
-                    disp,
-                    BackupScreen(
-                        disp.width,
-                        disp.height,
-                        device_label='device',
-                        copying_from=str(src),
-                        copying_to=str(paths.trip_root()),
-                        eta_min=None,
-                        remaining_str=f"{bytes_to_gb(remaining)} free",
-                        progress=frac,
-                    ),
+            # Undervolted or overheating: wait for it to clear before starting (the
+            # copy itself also pauses, between files, if it comes back)
+            if power.level == PAUSED:
+                render_and_push(disp, ErrorScreen(disp.width, disp.height, 'Low power. Waiting...'))
+                power.wait_until(REDUCED)
+                render_and_push(disp, BackupScreen(disp.width, disp.height, 'device', src_str, str(paths.trip_root()), None, f"{bytes_to_gb(remaining)} free", 0.0))
+
+            # The engine publishes progress (bytes-based, with ETA) on the bus; the
+            # display consumer coalesces it so copying never waits for a refresh.
+            def progress_screen(p):
+                eta_min = int(p.eta_s // 60) + 1 if p.eta_s is not None else None
+                return BackupScreen(
+                    disp.width,
+                    disp.height,
+                    device_label=p.device,
+                    copying_from=src_str,
+                    copying_to=str(paths.trip_root()),
+                    eta_min=eta_min,
+                    remaining_str=f"{bytes_to_gb(remaining)} free",
+                    progress=p.fraction,
                 )
 
-            # Check undervoltage; pause until stable
-            if is_undervoltage():
-                render_and_push(disp, ErrorScreen(disp.width, disp.height, 'Low power. Waiting...'))
-                while is_undervoltage():
-                    time.sleep(2)
-                render_and_push(disp, BackupScreen(disp.width, disp.height, 'device', str(src), str(paths.trip_root()), None, f"{bytes_to_gb(remaining)} free", 0.0))
+            hw = cfg.get('hardware', {})
+            display = ProgressDisplay(
+                disp, bus, progress_screen,
+                interval_s=float(hw.get('refresh_interval_s', 10)),
+                min_interval_s=float(hw.get('refresh_min_interval_s', 3)),
+                step=float(hw.get('refresh_step', 0.1)),
+            ).start()
+            short = None
+            try:
+                results = backup_sources(matches, paths, verify_mode=cfg['verify']['default_mode'], bus=bus, power=power)
+            except InsufficientSpace as e:
+                short = e
+            finally:
+                display.stop()
+            if short is not None:
+                render_and_push(disp, ErrorScreen(disp.width, disp.height, f'Not enough space: need {bytes_to_gb(short.needed)}'))
+                _wait_for_home(buttons, dev_mode)
+                continue
 
-            result = copy_from_source(src, paths, verify_mode=cfg['verify']['default_mode'], progress_cb=progress_cb)
+            # Verify screen (since per-file verify is done); show 100% and the read-back speed.
+            method = cfg['verify']['default_mode'].upper()
+            rate = sum(r.verify_throughput for r in results)
+            if rate:
+                method = f"{method} {rate / 1_000_000:.0f}MB/s"
+            render_and_push(disp, VerifyScreen(disp.width, disp.height, method, 1.0))
 
-            # Verify screen (since per-file verify is done); show 100%.
-            render_and_push(disp, VerifyScreen(disp.width, disp.height, cfg['verify']['default_mode'].upper(), 1.0))
+            # Previews are built by the proxy worker service; the backup only queues what it wrote.
+            # Queue before looking at errors: files a failing card did commit still need previews.
+            written = [entry_for(dst, paths.trip_root()) for r in results for dst in r.written]
+            queue = ProxyQueue(paths.proxy_queue_db)
+            try:
+                queue.enqueue(pending_jobs((e for e in written if e is not None), paths.proxies_dir()))
+            finally:
+                queue.close()
 
-            if result.errors:
+            if any(r.errors for r in results):
                 render_and_push(disp, ErrorScreen(disp.width, disp.height, 'Verify failed'))
                 _wait_for_home(buttons, dev_mode)
                 continue
 
-            # Start proxies after verification
-            generate_for_folder(paths.trip_root(), paths.proxies_dir(), cfg['previews']['max_cache_gb'] * 1_000_000_000, height=cfg['previews']['video_height'], bitrate=str(cfg['previews']['video_bitrate']))
-
             # Done
-            render_and_push(disp, DoneScreen(disp.width, disp.height, result.copied_files))
+            render_and_push(disp, DoneScreen(disp.width, disp.height, sum(r.copied_files for r in results)))
             _wait_for_home(buttons, dev_mode)
 
         elif sel == 1:
@@ -226,11 +276,17 @@ def run(dev_mode: bool = True):
         elif sel == 2:
             # Info screen (simple values)
             free = psutil.disk_usage(str(paths.nvme_mount)).free
+            queue = ProxyQueue(paths.proxy_queue_db)
+            try:
+                jobs = queue.status()
+            finally:
+                queue.close()
             stats = {
                 'video_hours': '?',
                 'photo_count': '?',
                 'free_gb': bytes_to_gb(free),
                 'cards': 0,
+                'previews': previews_status(jobs),
             }
             render_and_push(disp, InfoScreen(disp.width, disp.height, stats))
             _wait_for_home(buttons, dev_mode)
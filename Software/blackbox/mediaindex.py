@@ -0,0 +1,198 @@
+from __future__ import annotations
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from dataclasses import dataclass
+from pathlib import Path
+import os
+import posixpath
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .inventory import MediaEntry, media_kind
+from .state.db import connect
+
+
+# Sort orders: column tuple and direction; rel breaks ties so every order is total
+NEWEST = 'newest'
+OLDEST = 'oldest'
+NAME = 'name'
+ORDERS = {NEWEST: ('mtime_ns', 'DESC'), OLDEST: ('mtime_ns', 'ASC'), NAME: ('rel', 'ASC')}
+
+
+@dataclass
+class Page:
+    items: List[MediaEntry]
+    total: int
+    next: Optional[str]   # cursor of the following page, None on the last one
+    prev: Optional[str]   # cursor of the preceding page, None on the first one
+
+
+def _encode(entry: MediaEntry, order: str) -> str:
+    key = entry.rel if order == NAME else f'{entry.mtime_ns}/{entry.rel}'
+    return urlsafe_b64encode(key.encode('utf-8', 'surrogateescape')).decode('ascii')
+
+
+def _decode(cursor: str, order: str) -> tuple:
+    key = urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8', 'surrogateescape')
+    if order == NAME:
+        return (key,)
+    mtime, _, rel = key.partition('/')
+    return int(mtime), rel
+
+
+class MediaIndex:
+    """Persistent index of the media in each trip, for listing without walking the disk.
+
+    Rows are keyed by (trip, rel), rel being the posix path below the trip
+    folder. The backup adds what it writes; ``reconcile`` catches everything
+    else (deletions, files copied in by hand) by comparing directory mtimes
+    with the recorded ones and re-listing only directories that changed, so
+    a pass over an unchanged trip is one stat per directory. Files edited in
+    place without a rename are not noticed.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._db = connect(
+            db_path,
+            'CREATE TABLE IF NOT EXISTS media ('
+            ' trip TEXT NOT NULL, rel TEXT NOT NULL, dir TEXT NOT NULL, kind TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, PRIMARY KEY (trip, rel));'
+            'CREATE INDEX IF NOT EXISTS media_time ON media(trip, kind, mtime_ns, rel);'
+            'CREATE INDEX IF NOT EXISTS media_name ON media(trip, kind, rel);'
+            'CREATE INDEX IF NOT EXISTS media_dir ON media(trip, dir);'
+            'CREATE TABLE IF NOT EXISTS dirs ('
+            ' trip TEXT NOT NULL, rel TEXT NOT NULL, parent TEXT, mtime_ns INTEGER NOT NULL, PRIMARY KEY (trip, rel));',
+        )
+
+    def add(self, trip: str, entries: Iterable[MediaEntry]) -> None:
+        """Record files just written below the trip folder (entries relative to it)."""
+        rows = [(trip, e.rel, posixpath.dirname(e.rel), e.kind, e.size, e.mtime_ns) for e in entries]
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO media(trip, rel, dir, kind, size, mtime_ns) VALUES (?,?,?,?,?,?)'
+                ' ON CONFLICT(trip, rel) DO UPDATE SET kind=excluded.kind, size=excluded.size, mtime_ns=excluded.mtime_ns',
+                rows,
+            )
+            self._db.commit()
+
+    def _list_dir(self, trip: str, root: Path, rel: str, known: Dict[str, tuple]) -> Tuple[List[tuple], List[str]]:
+        """Media rows and subdirectories of one directory; only new names are stat'ed."""
+        rows, subdirs = [], []
+        with os.scandir(root / rel if rel else root) as it:
+            for de in it:
+                if de.name.startswith('.'):
+                    continue
+                child = f'{rel}/{de.name}' if rel else de.name
+                try:
+                    if de.is_dir(follow_symlinks=False):
+                        subdirs.append(child)
+                        continue
+                    kind = media_kind(de.name)
+                    if kind is None or not de.is_file(follow_symlinks=False):
+                        continue
+                    if child in known:
+                        rows.append((trip, child, rel, kind) + known[child])
+                        continue
+                    st = de.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                rows.append((trip, child, rel, kind, st.st_size, st.st_mtime_ns))
+        return rows, subdirs
+
+    def reconcile(self, trip: str, root: Path) -> int:
+        """Bring the trip's rows in line with the disk; return how many directories were re-listed."""
+        with self._lock:
+            dirs = {rel: (parent, mtime) for rel, parent, mtime in
+                    self._db.execute('SELECT rel, parent, mtime_ns FROM dirs WHERE trip=?', (trip,))}
+        children: Dict[str, List[str]] = {}
+        for rel, (parent, _) in dirs.items():
+            if parent is not None:
+                children.setdefault(parent, []).append(rel)
+        seen, relisted = set(), 0
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            try:
+                mtime = os.stat(root / rel if rel else root).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel)
+            if rel in dirs and dirs[rel][1] == mtime:
+                stack.extend(children.get(rel, ()))
+                continue
+            with self._lock:
+                known = {r: (size, m) for r, size, m in
+                         self._db.execute('SELECT rel, size, mtime_ns FROM media WHERE trip=? AND dir=?', (trip, rel))}
+            try:
+                rows, subdirs = self._list_dir(trip, root, rel, known)
+            except OSError:
+                continue
+            relisted += 1
+            with self._lock:
+                self._db.execute('DELETE FROM media WHERE trip=? AND dir=?', (trip, rel))
+                self._db.executemany('INSERT INTO media(trip, rel, dir, kind, size, mtime_ns) VALUES (?,?,?,?,?,?)', rows)
+                self._db.execute('INSERT OR REPLACE INTO dirs(trip, rel, parent, mtime_ns) VALUES (?,?,?,?)',
+                                 (trip, rel, posixpath.dirname(rel) if rel else None, mtime))
+                self._db.commit()
+            stack.extend(subdirs)
+        gone = [rel for rel in dirs if rel not in seen]
+        if gone:
+            with self._lock:
+                self._db.executemany('DELETE FROM dirs WHERE trip=? AND rel=?', ((trip, r) for r in gone))
+                self._db.executemany('DELETE FROM media WHERE trip=? AND dir=?', ((trip, r) for r in gone))
+                self._db.commit()
+        return relisted
+
+    def count(self, trip: str, kind: str) -> int:
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM media WHERE trip=? AND kind=?', (trip, kind)).fetchone()[0]
+
+    def page(self, trip: str, kind: str, order: str = NAME, limit: int = 50, after: Optional[str] = None,
+             before: Optional[str] = None, root: Optional[Path] = None) -> Page:
+        """One page of the trip's media of ``kind``, following or preceding a cursor.
+
+        Keyset pagination: each page is an index range scan, however deep, and
+        stays consistent while files are added. ``root`` (the trip folder) fills
+        in MediaEntry.path. Raises ValueError for an unknown order or a bad cursor.
+        """
+        if order not in ORDERS:
+            raise ValueError(f'unknown order {order!r}')
+        col, direction = ORDERS[order]
+        cols = ('rel',) if col == 'rel' else (col, 'rel')
+        backwards = before is not None
+        desc = (direction == 'DESC') != backwards
+        sql = 'SELECT rel, kind, size, mtime_ns FROM media WHERE trip=? AND kind=?'
+        args: list = [trip, kind]
+        cursor = before if backwards else after
+        if cursor:
+            try:
+                key = _decode(cursor, order)
+            except (ValueError, UnicodeError):
+                raise ValueError('bad cursor')
+            sql += f" AND ({', '.join(cols)}) {'<' if desc else '>'} ({', '.join('?' * len(cols))})"
+            args.extend(key)
+        sql += ' ORDER BY ' + ', '.join(f"{c} {'DESC' if desc else 'ASC'}" for c in cols) + ' LIMIT ?'
+        args.append(limit + 1)
+        with self._lock:
+            rows = self._db.execute(sql, args).fetchall()
+        more = len(rows) > limit
+        if backwards and not more:
+            # Walked back to the start: serve the real first page so pages line up again
+            return self.page(trip, kind, order, limit, root=root)
+        rows = rows[:limit]
+        if backwards:
+            rows.reverse()
+        base = root if root is not None else Path('.')
+        items = [MediaEntry(base / rel, rel, k, size, mtime) for rel, k, size, mtime in rows]
+        has_next = bool(items) and (backwards or more)
+        has_prev = bool(items) and (backwards or bool(cursor))
+        return Page(
+            items=items,
+            total=self.count(trip, kind),
+            next=_encode(items[-1], order) if has_next else None,
+            prev=_encode(items[0], order) if has_prev else None,
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
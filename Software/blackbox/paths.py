@@ -1,39 +1,112 @@
 from __future__ import annotations
 import os
+import threading
 from pathlib import Path
-from .config import load_config
+from typing import Dict, Optional
+from .config import config_version, get_config
+
+
+class _Derived:
+    """A Paths attribute computed from the config (see Paths._current)."""
+
+    def __set_name__(self, owner, name: str):
+        self.name = name
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        return obj._current()[self.name]
 
 
 class Paths:
+    """Folder layout on the NVMe, derived from the config.
+
+    Without an explicit cfg it follows the live config: directories are
+    computed once and re-derived only when the config changes (e.g. a trip
+    renamed in the web settings), so a lookup costs no YAML parsing. Folders
+    are created the first time they are asked for, not on every call.
+    """
+
+    cfg = _Derived()
+    nvme_mount = _Derived()
+    root = _Derived()
+    trips = _Derived()
+    proxies = _Derived()
+    logs = _Derived()
+    state = _Derived()
+    manifest_db = _Derived()
+    journal_db = _Derived()
+    cards_db = _Derived()
+    proxy_queue_db = _Derived()
+    media_db = _Derived()
+    trip = _Derived()
+
     def __init__(self, cfg: dict | None = None):
-        self.cfg = cfg or load_config()
-        self.nvme_mount = Path(self.cfg['paths']['nvme_mount'])
-        self.root = self.nvme_mount / 'Blackbox'
-        self.trips = self.root / 'trips'
-        self.proxies = self.root / self.cfg['paths'].get('proxies_subdir', 'proxies')
-        self.logs = self.root / 'logs'
+        self._live = cfg is None
+        self._lock = threading.Lock()
+        self._made: set = set()
+        self._version: Optional[int] = None
+        self._derived: Dict[str, object] = self._derive(cfg) if cfg is not None else {}
 
-    def ensure(self):
-        for p in [self.root, self.trips, self.proxies, self.logs]:
+    @staticmethod
+    def _derive(cfg: dict) -> Dict[str, object]:
+        nvme_mount = Path(cfg['paths']['nvme_mount'])
+        root = nvme_mount / 'Blackbox'
+        state = root / 'state'
+        return {
+            'cfg': cfg,
+            'nvme_mount': nvme_mount,
+            'root': root,
+            'trips': root / 'trips',
+            'proxies': root / cfg['paths'].get('proxies_subdir', 'proxies'),
+            'logs': root / 'logs',
+            'state': state,
+            'manifest_db': state / 'manifest.db',
+            'journal_db': state / 'journal.db',
+            'cards_db': state / 'cards.db',
+            'proxy_queue_db': state / 'proxies.db',
+            'media_db': state / 'media.db',
+            'trip': root / 'trips' / cfg['trip']['name'],
+        }
+
+    def _current(self) -> Dict[str, object]:
+        if self._live:
+            version = config_version()
+            if version != self._version:
+                with self._lock:
+                    self._derived = self._derive(get_config())
+                    self._version = version
+        return self._derived
+
+    def _mkdir(self, p: Path) -> Path:
+        if p not in self._made:
             p.mkdir(parents=True, exist_ok=True)
+            self._made.add(p)
+        return p
+
+    def frozen(self) -> 'Paths':
+        """A copy pinned to the current config, for work that must not move folders midway."""
+        return Paths(self.cfg)
+
+    def ensure(self):
+        for p in [self.root, self.trips, self.proxies, self.logs, self.state]:
+            self._mkdir(p)
         return self
 
     def trip_root(self) -> Path:
-        t = self.cfg['trip']['name']
-        path = self.trips / t
-        path.mkdir(parents=True, exist_ok=True)
-        return path
-
-    def photos_dir(self) -> Path:
-        p = self.trip_root() / 'photos'
-        p.mkdir(parents=True, exist_ok=True)
+        return self._mkdir(self.trip)
+
+    def photos_dir(self, create: bool = True) -> Path:
+        p = self.trip / 'photos'
+        if create:
+            self._mkdir(p)
         return p
 
-    def videos_dir(self, date_str: str, device_label: str) -> Path:
-        p = self.trip_root() / date_str / device_label
-        p.mkdir(parents=True, exist_ok=True)
+    def videos_dir(self, date_str: str, device_label: str, create: bool = True) -> Path:
+        p = self.trip / date_str / device_label
+        if create:
+            self._mkdir(p)
         return p
 
     def proxies_dir(self) -> Path:
-        self.proxies.mkdir(parents=True, exist_ok=True)
-        return self.proxies
+        return self._mkdir(self.proxies)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+from pathlib import Path
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from ..state.db import connect
+
+
+INDEX_NAME = '.index.db'
+# Access times closer together than this are not written again
+TOUCH_RESOLUTION_S = 60.0
+# Every cache entry is named after its content key: <key>.jpg, <key>.240.webp, <key>.hls, ...
+_KEY_RE = re.compile(r'^(.*-[0-9a-f]{16})\.')
+
+
+def key_of(name: str) -> Optional[str]:
+    """Content key of a cache entry name, None for anything else."""
+    m = _KEY_RE.match(name)
+    return m.group(1) if m else None
+
+
+def _dir_size(path: Path) -> int:
+    with os.scandir(path) as it:
+        return sum(de.stat(follow_symlinks=False).st_size for de in it if de.is_file(follow_symlinks=False))
+
+
+class PreviewCache:
+    """Index of the preview cache directory for size accounting and LRU eviction.
+
+    Lives next to the previews (``<cache_dir>/.index.db``) and is shared by
+    the proxy worker, which adds entries and evicts, and the web UI, which
+    records accesses. The running byte total is kept in the database by
+    triggers, so checking the limit is a single row read. A missing index is
+    rebuilt once from one scandir pass; ``trips`` (content key -> trip, e.g.
+    ProxyQueue.trips_by_key) restores which trip each entry belongs to, so
+    pinning survives a lost index. An entry is a file, or a directory holding
+    one live stream's segments (``<key>.hls``), sized and evicted as a whole.
+
+    Evicted previews are built again on demand: the web UI re-enqueues a
+    preview it is asked for and cannot find.
+    """
+
+    def __init__(self, cache_dir: Path, trips: Optional[Callable[[], Dict[str, str]]] = None):
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.cache_dir = cache_dir
+        self._trips = trips
+        self._lock = threading.Lock()
+        self._touched: Dict[str, float] = {}
+        fresh = not (cache_dir / INDEX_NAME).exists()
+        self._db = connect(
+            cache_dir / INDEX_NAME,
+            'CREATE TABLE IF NOT EXISTS entries ('
+            ' name TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL, trip TEXT);'
+            'CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access);'
+            'CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);'
+            'INSERT OR IGNORE INTO totals(id, bytes) VALUES (0, 0);'
+            'CREATE TRIGGER IF NOT EXISTS entries_ins AFTER INSERT ON entries'
+            ' BEGIN UPDATE totals SET bytes = bytes + NEW.size WHERE id = 0; END;'
+            'CREATE TRIGGER IF NOT EXISTS entries_del AFTER DELETE ON entries'
+            ' BEGIN UPDATE totals SET bytes = bytes - OLD.size WHERE id = 0; END;'
+            'CREATE TRIGGER IF NOT EXISTS entries_upd AFTER UPDATE OF size ON entries'
+            ' BEGIN UPDATE totals SET bytes = bytes - OLD.size + NEW.size WHERE id = 0; END;',
+        )
+        if fresh:
+            self.rebuild()
+
+    def rebuild(self) -> int:
+        """Re-index the directory from scratch; access times start from file mtimes."""
+        trips = self._trips() if self._trips is not None else {}
+        rows = []
+        with os.scandir(self.cache_dir) as it:
+            for de in it:
+                if de.name.startswith('.'):
+                    continue
+                trip = trips.get(key_of(de.name))
+                if de.is_file(follow_symlinks=False):
+                    st = de.stat(follow_symlinks=False)
+                    rows.append((de.name, st.st_size, st.st_mtime, trip))
+                elif de.is_dir(follow_symlinks=False) and de.name.endswith('.hls'):
+                    rows.append((de.name, _dir_size(Path(de.path)), de.stat(follow_symlinks=False).st_mtime, trip))
+        with self._lock:
+            self._db.execute('DELETE FROM entries')
+            self._db.executemany('INSERT INTO entries(name, size, last_access, trip) VALUES (?,?,?,?)', rows)
+            self._db.commit()
+        return len(rows)
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return self._db.execute('SELECT bytes FROM totals WHERE id = 0').fetchone()[0]
+
+    def add(self, path: Path, trip: Optional[str] = None) -> None:
+        """Index a preview (file or stream directory) just written to the cache directory."""
+        size = _dir_size(path) if path.is_dir() else path.stat().st_size
+        with self._lock:
+            # UPSERT rather than REPLACE: REPLACE deletes without firing the delete trigger
+            self._db.execute(
+                'INSERT INTO entries(name, size, last_access, trip) VALUES (?,?,?,?)'
+                ' ON CONFLICT(name) DO UPDATE SET size=excluded.size, last_access=excluded.last_access,'
+                '  trip=COALESCE(excluded.trip, entries.trip)',
+                (path.name, size, time.time(), trip),
+            )
+            self._db.commit()
+
+    def touch(self, path: Path) -> None:
+        """Record an access (e.g. a preview served by the web UI)."""
+        now = time.time()
+        if now - self._touched.get(path.name, 0.0) < TOUCH_RESOLUTION_S:
+            return
+        self._touched[path.name] = now
+        with self._lock:
+            self._db.execute('UPDATE entries SET last_access=? WHERE name=?', (now, path.name))
+            self._db.commit()
+
+    def evict(self, max_bytes: int, pinned_trip: Optional[str] = None) -> int:
+        """Delete least recently used previews until the total fits max_bytes.
+
+        Entries recorded for ``pinned_trip`` are never evicted. Returns the
+        number of bytes freed.
+        """
+        freed = 0
+        with self._lock:
+            total = self._db.execute('SELECT bytes FROM totals WHERE id = 0').fetchone()[0]
+            if total <= max_bytes:
+                return 0
+            rows = self._db.execute(
+                'SELECT name, size FROM entries WHERE trip IS NULL OR trip != ? ORDER BY last_access',
+                (pinned_trip or '',),
+            )
+            victims = []
+            for name, size in rows:
+                if total - freed <= max_bytes:
+                    break
+                victims.append(name)
+                freed += size
+            for name in victims:
+                p = self.cache_dir / name
+                if p.is_dir():
+                    shutil.rmtree(p, ignore_errors=True)
+                else:
+                    p.unlink(missing_ok=True)
+            self._db.executemany('DELETE FROM entries WHERE name=?', ((n,) for n in victims))
+            self._db.commit()
+        return freed
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -1,86 +1,221 @@
 from __future__ import annotations
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+import hashlib
 import subprocess
 import shutil
 import os
-from typing import Iterable
+import signal
+import threading
+from typing import Callable, Iterable, List, Optional, Set
 
-VIDEO_EXTS = {'.mp4', '.mov', '.m4v'}
-PHOTO_EXTS = {'.jpg', '.jpeg', '.png', '.rw2', '.cr2', '.nef', '.raf', '.dng', '.arw'}
+from ..hardware.power import PAUSED, PowerMonitor, PowerState, Throttle
+from ..inventory import PHOTO, VIDEO, MediaEntry
+from .sidecars import install_staged
+from .thumbs import open_scaled
 
 
 def _run(cmd: list[str]) -> int:
     return subprocess.call(cmd)
 
 
-def ensure_cache_limit(cache_dir: Path, max_bytes: int) -> None:
-    """Delete oldest files until total size <= max_bytes."""
-    cache_dir.mkdir(parents=True, exist_ok=True)
-    items = [(p, p.stat().st_mtime, p.stat().st_size) for p in cache_dir.glob('**/*') if p.is_file()]
-    total = sum(sz for _, _, sz in items)
-    if total <= max_bytes:
-        return
-    items.sort(key=lambda t: t[1])  # oldest first
-    for p, _, sz in items:
-        try:
-            p.unlink()
-            total -= sz
-            if total <= max_bytes:
-                break
-        except Exception:
-            pass
+def content_key(name: str, size: int, mtime_ns: int) -> str:
+    """Cache key from file identity (name, size, mtime), independent of where the file lives.
+
+    Backups preserve mtime, so a trip rename or a new nvme_mount keeps every key.
+    """
+    digest = hashlib.sha1(f'{name}\0{size}\0{mtime_ns}'.encode('utf-8', 'surrogateescape')).hexdigest()[:16]
+    return f"{Path(name).stem}-{digest}"
+
+
+# Photo pyramid: the lightbox size is the primary thumbnail, the grid size feeds the gallery
+THUMB_SIZE = 720
+GRID_SIZE = 240
+THUMB_FORMATS = {'jpg': ('JPEG', {'quality': 85}), 'webp': ('WEBP', {'quality': 80, 'method': 4})}
+
+
+def preview_path(cache_dir: Path, kind: str, key: str) -> Path:
+    return cache_dir / (f"{key}.jpg" if kind == PHOTO else f"{key}.mp4")
+
+
+def thumb_variant(primary: Path, size: int, fmt: str = 'jpg') -> Path:
+    """Pyramid sibling of a primary thumbnail: <key>.jpg is 720 px, <key>.240.webp etc."""
+    key = primary.stem
+    return primary.with_name(f"{key}.{fmt}" if size == THUMB_SIZE else f"{key}.{size}.{fmt}")
+
+
+def thumb_variants(primary: Path) -> List[Path]:
+    return [thumb_variant(primary, size, fmt) for size in (THUMB_SIZE, GRID_SIZE) for fmt in THUMB_FORMATS]
 
 
-def proxy_name_for(src: Path, cache_dir: Path) -> Path:
-    safe = src.relative_to(src.anchor).as_posix().replace('/', '_')
-    return cache_dir / f"{safe}.mp4"
+def _key_for(src: Path, st: Optional[os.stat_result]) -> str:
+    st = st or src.stat()
+    return content_key(src.name, st.st_size, st.st_mtime_ns)
 
 
-def thumb_name_for(src: Path, cache_dir: Path) -> Path:
-    safe = src.relative_to(src.anchor).as_posix().replace('/', '_')
-    return cache_dir / f"{safe}.jpg"
+def proxy_name_for(src: Path, cache_dir: Path, st: Optional[os.stat_result] = None) -> Path:
+    """Proxy path for src; stats src unless st is given."""
+    return preview_path(cache_dir, VIDEO, _key_for(src, st))
 
 
-def build_video_proxy(src: Path, dst: Path, height: int = 480, bitrate: str = '1200k') -> int:
+def thumb_name_for(src: Path, cache_dir: Path, st: Optional[os.stat_result] = None) -> Path:
+    """Thumbnail path for src; stats src unless st is given."""
+    return preview_path(cache_dir, PHOTO, _key_for(src, st))
+
+
+def build_video_proxy(src: Path, dst: Path, height: int = 480, bitrate: str = '1200k', threads: int = 0,
+                      run: Callable[[list[str]], int] = _run) -> int:
     dst.parent.mkdir(parents=True, exist_ok=True)
+    # Write under a temp name: a worker killed mid-transcode must not leave a truncated proxy
+    tmp = dst.with_name(f'.{dst.name}.part')
     cmd = [
         'ffmpeg', '-y', '-i', str(src), '-vf', f"scale=-2:{height}",
         '-c:v', 'libx264', '-b:v', bitrate, '-preset', 'veryfast', '-movflags', '+faststart',
-        '-an', str(dst)
+        '-threads', str(threads), '-an', '-f', 'mp4', str(tmp)
     ]
-    return _run(cmd)
+    rc = run(cmd)
+    if rc == 0:
+        os.replace(tmp, dst)
+    else:
+        tmp.unlink(missing_ok=True)
+    return rc
+
+
+def _save(img, dst: Path, fmt: str) -> None:
+    tmp = dst.with_name(f'.{dst.name}.part')
+    pil_format, options = THUMB_FORMATS[fmt]
+    img.save(tmp, format=pil_format, **options)
+    os.replace(tmp, dst)
+
 
+def build_photo_thumb(src: Path, dst: Path, size: int = THUMB_SIZE, webp: bool = False) -> int:
+    """Build the thumbnail pyramid of src: dst at size px, plus the grid size; optionally WebP too.
 
-def build_photo_thumb(src: Path, dst: Path, size: int = 720) -> int:
+    The source is decoded once; the grid image is scaled from the thumbnail.
+    dst is written last, so its presence means the whole pyramid exists.
+    """
     try:
-        from PIL import Image
-        img = Image.open(src)
+        img = open_scaled(src, size)
         img.thumbnail((size, size))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        grid = img.copy()
+        grid.thumbnail((GRID_SIZE, GRID_SIZE))
         dst.parent.mkdir(parents=True, exist_ok=True)
-        img.save(dst, quality=85)
+        fmts = ['webp', 'jpg'] if webp and _webp_supported() else ['jpg']
+        for fmt in fmts:
+            _save(grid, thumb_variant(dst, GRID_SIZE, fmt), fmt)
+            _save(img, thumb_variant(dst, THUMB_SIZE, fmt), fmt)
         return 0
     except Exception:
         return 1
 
 
-def generate_for_folder(folder: Path, cache_dir: Path, max_cache_bytes: int, prefer_gopro_thm: bool = True, height: int = 480, bitrate: str = '1200k') -> None:
-    cache_dir.mkdir(parents=True, exist_ok=True)
-
-    for dirpath, _, files in os.walk(folder):
-        for fn in files:
-            p = Path(dirpath) / fn
-            ext = p.suffix.lower()
-            if ext in VIDEO_EXTS:
-                proxy = proxy_name_for(p, cache_dir)
-                if proxy.exists():
-                    continue
-                # Use GoPro THM only as a still thumbnail, still generate 480p proxy for playback
-                build_video_proxy(p, proxy, height=height, bitrate=bitrate)
-            elif ext in PHOTO_EXTS:
-                thumb = thumb_name_for(p, cache_dir)
-                if thumb.exists():
-                    continue
-                build_photo_thumb(p, thumb)
-
-    ensure_cache_limit(cache_dir, max_cache_bytes)
-
+def _webp_supported() -> bool:
+    from PIL import features
+    return bool(features.check('webp'))
+
+
+@dataclass
+class ProxyJob:
+    kind: str       # PHOTO (thumbnail) or VIDEO (proxy)
+    src: Path
+    dst: Path
+    mtime_ns: int
+
+
+def pending_jobs(entries: Iterable[MediaEntry], cache_dir: Path) -> List[ProxyJob]:
+    """Jobs for entries without a cached preview: photo thumbnails first, then newest first."""
+    jobs = []
+    for e in entries:
+        dst = preview_path(cache_dir, e.kind, content_key(e.name, e.size, e.mtime_ns))
+        if not dst.exists():
+            jobs.append(ProxyJob(e.kind, e.path, dst, e.mtime_ns))
+    jobs.sort(key=lambda j: (j.kind != PHOTO, -j.mtime_ns))
+    return jobs
+
+
+def job_outputs(job: ProxyJob) -> List[Path]:
+    """Files a finished job wrote into the cache (for a video, also its camera poster)."""
+    if job.kind != PHOTO:
+        return [p for p in (job.dst, job.dst.with_suffix('.jpg')) if p.exists()]
+    return [p for p in thumb_variants(job.dst) if p.exists()]
+
+
+class ProxyPool:
+    """Builds previews concurrently.
+
+    Thumbnails run on all ``workers`` threads (PIL releases the GIL while
+    decoding); at most ``max_transcodes`` ffmpeg processes run at once, each
+    given an equal share of the cores. With ``use_sidecars`` a video whose
+    camera proxy (GoPro LRV, DJI LRF) was staged by the backup is only
+    remuxed, which needs no transcode slot. Jobs start in the order given.
+
+    With a power monitor the pool backs off while the Pi is throttled (half
+    the thumbnail threads, one transcode) and starts nothing while it is
+    undervolted or too hot; running ffmpeg processes are stopped (SIGSTOP)
+    until the level recovers.
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_transcodes: int = 2, height: int = 480, bitrate: str = '1200k',
+                 webp: bool = False, use_sidecars: bool = True, power: Optional[PowerMonitor] = None):
+        cores = os.cpu_count() or 1
+        self.webp = webp
+        self.use_sidecars = use_sidecars
+        self.workers = max(1, workers or cores)
+        self.max_transcodes = max(1, min(max_transcodes, self.workers))
+        self.height = height
+        self.bitrate = bitrate
+        self.power = power
+        self._ffmpeg_threads = max(1, cores // self.max_transcodes)
+        self._thumbs = Throttle(power, self.workers, max(1, self.workers // 2))
+        self._transcodes = Throttle(power, self.max_transcodes, 1)
+        self._procs: Set[subprocess.Popen] = set()
+        self._procs_lock = threading.Lock()
+        if power is not None:
+            power.listen(self._on_power)
+
+    def close(self) -> None:
+        """Stop following the power monitor (the pool is being replaced)."""
+        if self.power is not None:
+            self.power.unlisten(self._on_power)
+
+    def _on_power(self, state: PowerState) -> None:
+        sig = signal.SIGSTOP if state.level == PAUSED else signal.SIGCONT
+        with self._procs_lock:
+            for proc in self._procs:
+                if proc.poll() is None:
+                    proc.send_signal(sig)
+
+    def _ffmpeg(self, cmd: list[str]) -> int:
+        proc = subprocess.Popen(cmd, stdin=subprocess.DEVNULL)
+        with self._procs_lock:
+            self._procs.add(proc)
+            if self.power is not None and self.power.level == PAUSED:
+                proc.send_signal(signal.SIGSTOP)
+        try:
+            return proc.wait()
+        finally:
+            with self._procs_lock:
+                self._procs.discard(proc)
+
+    def build(self, job: ProxyJob) -> bool:
+        if job.kind == VIDEO:
+            if self.use_sidecars and install_staged(job.dst):
+                return True
+            with self._transcodes:
+                rc = build_video_proxy(job.src, job.dst, height=self.height, bitrate=self.bitrate, threads=self._ffmpeg_threads,
+                                       run=self._ffmpeg)
+        else:
+            with self._thumbs:
+                rc = build_photo_thumb(job.src, job.dst, webp=self.webp)
+        return rc == 0
+
+    def run(self, jobs: Iterable[ProxyJob]) -> List[bool]:
+        """Build all jobs; return whether each one succeeded, in job order."""
+        jobs = list(jobs)
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='proxy') as pool:
+            return list(pool.map(self.build, jobs))
@@ -0,0 +1,115 @@
+from __future__ import annotations
+from pathlib import Path
+import threading
+import time
+from typing import Dict, Iterable, List, Set
+
+from ..inventory import VIDEO
+from ..state.db import connect
+from .generate import ProxyJob
+
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+MAX_ATTEMPTS = 3
+
+
+class ProxyQueue:
+    """Persistent queue of preview jobs, shared by the backup (producer) and the proxy worker.
+
+    Rows are keyed by source file. Jobs are handed out photo thumbnails first,
+    then newest first. A job that was running when the worker stopped goes
+    back to pending on ``recover``; a job failing MAX_ATTEMPTS times is parked
+    as failed until the file changes (new mtime or destination), however
+    often it is enqueued. A done job whose preview has gone (evicted) runs
+    again when enqueued.
+    """
+
+    def __init__(self, db_path: Path):
+        self._lock = threading.Lock()
+        self._db = connect(
+            db_path,
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' src TEXT PRIMARY KEY, kind TEXT NOT NULL, dst TEXT NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL);'
+            'CREATE INDEX IF NOT EXISTS jobs_order ON jobs(state, kind, mtime_ns);',
+        )
+
+    def enqueue(self, jobs: Iterable[ProxyJob]) -> None:
+        """Add jobs; a known file is only requeued if it changed, or is done but its preview is gone."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO jobs(src, kind, dst, mtime_ns, state, updated) VALUES (?,?,?,?,?,?)'
+                ' ON CONFLICT(src) DO UPDATE SET kind=excluded.kind, dst=excluded.dst, mtime_ns=excluded.mtime_ns,'
+                '  state=excluded.state, attempts=0, error=NULL, updated=excluded.updated'
+                ' WHERE jobs.mtime_ns != excluded.mtime_ns OR jobs.dst != excluded.dst OR (jobs.state = ? AND ?)',
+                ((str(j.src), j.kind, str(j.dst), j.mtime_ns, PENDING, now, DONE, not j.dst.exists()) for j in jobs),
+            )
+            self._db.commit()
+
+    def claim(self, n: int) -> List[ProxyJob]:
+        """Mark up to n pending jobs as running and return them in priority order."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT src, kind, dst, mtime_ns FROM jobs WHERE state=? ORDER BY kind=?, mtime_ns DESC LIMIT ?",
+                (PENDING, VIDEO, n),
+            ).fetchall()
+            self._db.executemany('UPDATE jobs SET state=?, updated=? WHERE src=?', ((RUNNING, time.time(), r[0]) for r in rows))
+            self._db.commit()
+        return [ProxyJob(kind, Path(src), Path(dst), mtime_ns) for src, kind, dst, mtime_ns in rows]
+
+    def done(self, job: ProxyJob) -> None:
+        with self._lock:
+            self._db.execute('UPDATE jobs SET state=?, error=NULL, updated=? WHERE src=?', (DONE, time.time(), str(job.src)))
+            self._db.commit()
+
+    def failed(self, job: ProxyJob, error: str = '') -> None:
+        """Count a failed attempt; the job is retried until MAX_ATTEMPTS."""
+        with self._lock:
+            self._db.execute(
+                'UPDATE jobs SET attempts=attempts+1, error=?, updated=?,'
+                ' state=CASE WHEN attempts+1 >= ? THEN ? ELSE ? END WHERE src=?',
+                (error, time.time(), MAX_ATTEMPTS, FAILED, PENDING, str(job.src)),
+            )
+            self._db.commit()
+
+    def recover(self) -> int:
+        """Requeue jobs left running by a stopped worker; return how many."""
+        with self._lock:
+            n = self._db.execute('UPDATE jobs SET state=? WHERE state=?', (PENDING, RUNNING)).rowcount
+            self._db.commit()
+        return n
+
+    def status(self) -> Dict[str, int]:
+        """Job count per state (every state present, zero if none)."""
+        counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+        with self._lock:
+            for state, n in self._db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state'):
+                counts[state] = n
+        return counts
+
+    def queued_keys(self) -> Set[str]:
+        """Content keys of the jobs still to run (pending or running)."""
+        with self._lock:
+            rows = self._db.execute('SELECT dst FROM jobs WHERE state IN (?, ?)', (PENDING, RUNNING)).fetchall()
+        return {Path(dst).stem for dst, in rows}
+
+    def trips_by_key(self, trips_root: Path) -> Dict[str, str]:
+        """Content key -> trip folder of its source, for every job whose source is below trips_root."""
+        out = {}
+        with self._lock:
+            rows = self._db.execute('SELECT src, dst FROM jobs').fetchall()
+        for src, dst in rows:
+            try:
+                out[Path(dst).stem] = Path(src).relative_to(trips_root).parts[0]
+            except (ValueError, IndexError):
+                continue
+        return out
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,169 @@
+from __future__ import annotations
+from dataclasses import dataclass, field
+from pathlib import Path
+import re
+import shutil
+import subprocess
+import threading
+import time
+from typing import Dict, Optional
+
+from .cache import PreviewCache
+
+
+PLAYLIST = 'index.m3u8'
+SEGMENT_RE = re.compile(r'^(index\.m3u8|seg_\d{5}\.ts)$')
+
+
+def hls_dir(cache_dir: Path, key: str) -> Path:
+    return cache_dir / f'{key}.hls'
+
+
+@dataclass
+class _Session:
+    out: Path
+    proc: Optional[subprocess.Popen] = None   # None until ffmpeg is started (or if it could not be)
+    started: threading.Event = field(default_factory=threading.Event)
+    last_access: float = field(default_factory=time.monotonic)
+
+
+class StreamBusy(Exception):
+    """No stream to serve yet: every transcode slot is taken, or ffmpeg is still starting."""
+
+    def __init__(self, message: str, retry_after_s: int):
+        super().__init__(message)
+        self.retry_after_s = retry_after_s
+
+
+class StreamFailed(Exception):
+    """ffmpeg could not be started, or exited before writing a playlist."""
+
+
+class LiveStreams:
+    """Just-in-time HLS transcodes for videos whose proxy is not built yet.
+
+    One ffmpeg per video, shared by everyone watching it, writes 4 s segments
+    into ``<cache_dir>/<key>.hls/`` as an event playlist the player can start
+    on right away. At most ``max_sessions`` run at once. A finished stream is
+    indexed in the preview cache and served from disk afterwards (evicted like
+    any other preview); a stream nobody fetched for ``idle_s`` is stopped and
+    its partial segments removed.
+    """
+
+    def __init__(self, cache: PreviewCache, max_sessions: int = 1, height: int = 360, bitrate: str = '800k',
+                 segment_s: int = 4, idle_s: float = 60.0):
+        self.cache = cache
+        self.max_sessions = max(1, max_sessions)
+        self.height = height
+        self.bitrate = bitrate
+        self.segment_s = segment_s
+        self.idle_s = idle_s
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, _Session] = {}
+        self._reaper: Optional[threading.Thread] = None
+
+    def _command(self, src: Path, out: Path) -> list[str]:
+        return [
+            'ffmpeg', '-y', '-v', 'error', '-i', str(src), '-vf', f'scale=-2:{self.height}',
+            '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', self.bitrate, '-threads', '2',
+            '-force_key_frames', f'expr:gte(t,n_forced*{self.segment_s})', '-an',
+            '-f', 'hls', '-hls_time', str(self.segment_s), '-hls_playlist_type', 'event',
+            '-hls_segment_filename', str(out / 'seg_%05d.ts'), str(out / PLAYLIST),
+        ]
+
+    def _complete(self, out: Path) -> bool:
+        try:
+            return '#EXT-X-ENDLIST' in (out / PLAYLIST).read_text()
+        except OSError:
+            return False
+
+    def open(self, src: Path, key: str, wait_s: float = 15.0) -> Path:
+        """Return the stream directory for src once its playlist exists.
+
+        Starts a transcode unless a finished or running stream for key exists.
+        Raises StreamBusy when all slots are taken or the playlist did not
+        appear within wait_s, StreamFailed when ffmpeg did not start or died
+        first (its directory is removed).
+        """
+        out = hls_dir(self.cache.cache_dir, key)
+        with self._lock:
+            session = self._sessions.get(key)
+            launch = session is None
+            if launch:
+                if self._complete(out):
+                    self.cache.touch(out)
+                    return out
+                if len(self._sessions) >= self.max_sessions:
+                    raise StreamBusy('all live transcodes are in use', 10)
+                # Reserve the slot; ffmpeg is started outside the lock
+                session = self._sessions[key] = _Session(out)
+            session.last_access = time.monotonic()
+        if launch:
+            self._launch(key, src, session)
+        deadline = time.monotonic() + wait_s
+        if not session.started.wait(wait_s):
+            raise StreamBusy('stream is starting', 2)
+        while not (out / PLAYLIST).exists():
+            if session.proc is None or session.proc.poll() is not None:
+                break
+            if time.monotonic() > deadline:
+                raise StreamBusy('stream is starting', 2)
+            time.sleep(0.2)
+        if (out / PLAYLIST).exists():
+            return out
+        self._drop(key, session)
+        raise StreamFailed(f'live transcode of {src.name} did not start')
+
+    def _launch(self, key: str, src: Path, session: _Session) -> None:
+        try:
+            shutil.rmtree(session.out, ignore_errors=True)
+            session.out.mkdir(parents=True)
+            session.proc = subprocess.Popen(self._command(src, session.out), stdin=subprocess.DEVNULL)
+        except OSError:
+            self._drop(key, session)
+        else:
+            with self._lock:
+                self._start_reaper()
+        finally:
+            session.started.set()
+
+    def _drop(self, key: str, session: _Session) -> None:
+        """Forget a stream that failed and remove what it wrote."""
+        with self._lock:
+            if self._sessions.get(key) is session:
+                del self._sessions[key]
+                shutil.rmtree(session.out, ignore_errors=True)
+
+    def touch(self, key: str) -> None:
+        """Note that a viewer fetched from this stream (keeps the transcode alive)."""
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                session.last_access = time.monotonic()
+
+    def _start_reaper(self) -> None:
+        if self._reaper is None or not self._reaper.is_alive():
+            self._reaper = threading.Thread(target=self._reap_loop, name='live-reaper', daemon=True)
+            self._reaper.start()
+
+    def _reap_loop(self) -> None:
+        while True:
+            time.sleep(2.0)
+            with self._lock:
+                if not self._sessions:
+                    return
+                for key, s in list(self._sessions.items()):
+                    if s.proc is None:
+                        continue
+                    rc = s.proc.poll()
+                    if rc is None and time.monotonic() - s.last_access > self.idle_s:
+                        s.proc.terminate()
+                        s.proc.wait()
+                        rc = -1
+                    if rc is None:
+                        continue
+                    del self._sessions[key]
+                    if rc == 0 and self._complete(s.out):
+                        self.cache.add(s.out)
+                    else:
+                        shutil.rmtree(s.out, ignore_errors=True)
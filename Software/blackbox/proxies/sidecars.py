@@ -0,0 +1,115 @@
+from __future__ import annotations
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import time
+from typing import Iterable, List, Optional, Set, Tuple
+
+
+# Low-res videos (MP4 containers) and still thumbnails made by the camera
+PROXY_EXTS = ('.lrv', '.lrf')
+POSTER_EXTS = ('.thm',)
+
+
+def incoming_dir(cache_dir: Path) -> Path:
+    """Staging area for sidecars copied off a card, waiting for the proxy worker."""
+    return cache_dir / '.incoming'
+
+
+def stage_sidecars(items: Iterable[Tuple[str, List[Path]]], cache_dir: Path) -> int:
+    """Copy sidecars off the card as <preview key><ext>; return how many were staged.
+
+    Runs during the backup while the card is still mounted; the proxy worker
+    picks them up later instead of transcoding the master.
+    """
+    staging = incoming_dir(cache_dir)
+    n = 0
+    for key, sidecars in items:
+        for src in sidecars:
+            ext = src.suffix.lower()
+            if ext not in PROXY_EXTS + POSTER_EXTS:
+                continue
+            tmp = staging / f'.{key}{ext}.part'
+            try:
+                staging.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, staging / f'{key}{ext}')
+                n += 1
+            except OSError:
+                # Staging is best effort: the worker transcodes the master instead
+                try:
+                    tmp.unlink(missing_ok=True)
+                except OSError:
+                    pass
+    return n
+
+
+def _staged(cache_dir: Path, key: str, exts: Tuple[str, ...]) -> Optional[Path]:
+    for ext in exts:
+        p = incoming_dir(cache_dir) / f'{key}{ext}'
+        if p.exists():
+            return p
+    return None
+
+
+def remux_faststart(src: Path, dst: Path) -> int:
+    """Rewrite a camera proxy as an MP4 with the index up front, without re-encoding."""
+    tmp = dst.with_name(f'.{dst.name}.part')
+    rc = subprocess.call(['ffmpeg', '-y', '-v', 'error', '-i', str(src), '-map', '0:v:0', '-map', '0:a?',
+                          '-c', 'copy', '-movflags', '+faststart', '-f', 'mp4', str(tmp)])
+    if rc == 0:
+        os.replace(tmp, dst)
+    else:
+        tmp.unlink(missing_ok=True)
+    return rc
+
+
+def install_staged(proxy: Path) -> bool:
+    """Install staged sidecars for the video proxy path ``<key>.mp4``.
+
+    The THM becomes the video's poster (``<key>.jpg``), an LRV/LRF is remuxed
+    into the proxy itself. Returns True if the proxy is now in place; the
+    caller transcodes the master otherwise.
+    """
+    cache_dir, key = proxy.parent, proxy.stem
+    thm = _staged(cache_dir, key, POSTER_EXTS)
+    if thm is not None:
+        os.replace(thm, proxy.with_suffix('.jpg'))
+    lrv = _staged(cache_dir, key, PROXY_EXTS)
+    if lrv is None:
+        return False
+    ok = remux_faststart(lrv, proxy) == 0
+    lrv.unlink(missing_ok=True)
+    return ok
+
+
+def prune_staged(cache_dir: Path, wanted: Set[str], orphan_after_s: float, max_age_s: float,
+                 now: Optional[float] = None) -> int:
+    """Remove staged sidecars no job will use; return how many were removed.
+
+    A file goes once no queued job wants its key (``wanted``) and it is older
+    than ``orphan_after_s`` (the backup stages before it enqueues), and in any
+    case after ``max_age_s``. Leftover partial copies go after orphan_after_s.
+    """
+    now = time.time() if now is None else now
+    n = 0
+    try:
+        it = os.scandir(incoming_dir(cache_dir))
+    except OSError:
+        return 0
+    with it:
+        for de in it:
+            try:
+                age = now - de.stat(follow_symlinks=False).st_mtime
+            except OSError:
+                continue
+            partial = de.name.startswith('.')
+            key = Path(de.name).stem
+            if age > max_age_s or (age > orphan_after_s and (partial or key not in wanted)):
+                try:
+                    os.unlink(de.path)
+                    n += 1
+                except OSError:
+                    pass
+    return n
@@ -0,0 +1,173 @@
+from __future__ import annotations
+from io import BytesIO
+from pathlib import Path
+import struct
+from typing import BinaryIO, List, Optional, Tuple
+
+
+# TIFF-structured raw formats (RW2 has its own magic but the same IFD layout)
+TIFF_RAW_EXTS = {'.cr2', '.nef', '.dng', '.arw', '.rw2'}
+RAF_EXT = '.raf'
+
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+# SOF markers PIL can decode: baseline, extended and progressive DCT (not lossless SOF3)
+_DECODABLE_SOF = {0xC0, 0xC1, 0xC2}
+_MAX_IFDS = 32
+
+# EXIF orientation -> PIL Image.Transpose member names
+_ORIENTATION = {2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM', 5: 'TRANSPOSE',
+                6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90'}
+
+
+def _values(f: BinaryIO, e: str, typ: int, count: int, raw: bytes) -> List[int]:
+    size = _TYPE_SIZES.get(typ, 1) * count
+    if size > 4:
+        f.seek(struct.unpack(e + 'I', raw)[0])
+        raw = f.read(size)
+    else:
+        raw = raw[:size]
+    if typ == 3:
+        return list(struct.unpack(f'{e}{count}H', raw))
+    if typ in (4, 13):
+        return list(struct.unpack(f'{e}{count}I', raw))
+    return list(raw)
+
+
+def _tiff_candidates(f: BinaryIO) -> Tuple[List[Tuple[int, int]], int]:
+    """(offset, length) of the JPEGs embedded in a TIFF-structured file, and its orientation.
+
+    Looks at JPEGInterchangeFormat (0x201/0x202), single-strip JPEG-compressed
+    images (CR2 IFD0, DNG previews), RW2 JpgFromRaw (0x2E), and follows both
+    the IFD chain and SubIFDs (0x14A).
+    """
+    f.seek(0)
+    head = f.read(8)
+    if len(head) < 8 or head[:2] not in (b'II', b'MM'):
+        return [], 1
+    e = '<' if head[:2] == b'II' else '>'
+    ifd0 = struct.unpack(e + 'I', head[4:8])[0]
+    found: List[Tuple[int, int]] = []
+    orientation = 1
+    todo, seen = [ifd0], set()
+    while todo and len(seen) < _MAX_IFDS:
+        off = todo.pop()
+        if not off or off in seen:
+            continue
+        seen.add(off)
+        try:
+            f.seek(off)
+            n = struct.unpack(e + 'H', f.read(2))[0]
+            entries = f.read(12 * n)
+            nxt = f.read(4)
+            if len(nxt) == 4:
+                todo.append(struct.unpack(e + 'I', nxt)[0])
+            tags = {}
+            for i in range(len(entries) // 12):
+                tag, typ, count = struct.unpack(e + 'HHI', entries[12 * i:12 * i + 8])
+                tags[tag] = (typ, count, entries[12 * i + 8:12 * i + 12])
+
+            def val(tag: int) -> List[int]:
+                return _values(f, e, *tags[tag])
+
+            if off == ifd0 and 0x112 in tags:
+                orientation = val(0x112)[0]
+            if 0x201 in tags and 0x202 in tags:
+                found.append((val(0x201)[0], val(0x202)[0]))
+            if 0x103 in tags and val(0x103)[0] in (6, 7) and 0x111 in tags and 0x117 in tags:
+                strips, counts = val(0x111), val(0x117)
+                if len(strips) == 1:
+                    found.append((strips[0], counts[0]))
+            if 0x2E in tags:
+                typ, count, raw = tags[0x2E]
+                found.append((struct.unpack(e + 'I', raw)[0], count))
+            if 0x14A in tags:
+                todo.extend(val(0x14A))
+        except struct.error:
+            continue
+    return found, orientation
+
+
+def _raf_candidates(f: BinaryIO) -> List[Tuple[int, int]]:
+    """Fujifilm RAF: the header points straight at a full-size JPEG preview."""
+    f.seek(0)
+    head = f.read(92)
+    if len(head) < 92 or not head.startswith(b'FUJIFILMCCD-RAW'):
+        return []
+    return [struct.unpack('>II', head[84:92])]
+
+
+def _jpeg_size(f: BinaryIO, offset: int, length: int) -> Optional[Tuple[int, int]]:
+    """(width, height) from the SOF of an embedded JPEG, or None if PIL cannot decode it."""
+    end = offset + length
+    pos = offset
+    f.seek(pos)
+    if f.read(2) != b'\xff\xd8':
+        return None
+    pos += 2
+    while pos + 4 <= end:
+        f.seek(pos)
+        head = f.read(4)
+        if len(head) < 4 or head[0] != 0xFF:
+            return None
+        marker, seglen = head[1], struct.unpack('>H', head[2:4])[0]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if marker not in _DECODABLE_SOF:
+                return None
+            sof = f.read(5)
+            if len(sof) < 5:
+                return None
+            h, w = struct.unpack('>HH', sof[1:5])
+            return w, h
+        if marker == 0xDA:
+            return None
+        pos += 2 + seglen
+    return None
+
+
+def embedded_preview(path: Path, size: int = 0) -> Tuple[Optional[bytes], int]:
+    """Return (JPEG bytes, orientation) of the best preview embedded in a raw file.
+
+    Prefers the smallest decodable preview at least ``size`` pixels on its long
+    side, else the largest one. Returns (None, 1) when there is none.
+    """
+    ext = path.suffix.lower()
+    with open(path, 'rb') as f:
+        if ext == RAF_EXT:
+            candidates, orientation = _raf_candidates(f), 1
+        elif ext in TIFF_RAW_EXTS:
+            candidates, orientation = _tiff_candidates(f)
+        else:
+            return None, 1
+        usable = []
+        for off, length in candidates:
+            if length <= 0:
+                continue
+            dims = _jpeg_size(f, off, length)
+            if dims is not None:
+                usable.append((max(dims), off, length))
+        if not usable:
+            return None, orientation
+        big_enough = [u for u in usable if u[0] >= size]
+        _, off, length = min(big_enough) if big_enough else max(usable)
+        f.seek(off)
+        return f.read(length), orientation
+
+
+def open_scaled(path: Path, size: int):
+    """Open an image for a thumbnail of ``size`` px as cheaply as possible.
+
+    Raw files use their embedded JPEG preview. JPEGs are opened in draft
+    mode, so libjpeg decodes at 1/2, 1/4 or 1/8 scale (DCT scaling) instead
+    of full resolution. Anything else is a normal full decode.
+    """
+    from PIL import Image, ImageOps
+    data, orientation = embedded_preview(path, size)
+    if data is not None:
+        img = Image.open(BytesIO(data))
+        img.draft('RGB', (size, size))
+        op = _ORIENTATION.get(orientation)
+        return img.transpose(getattr(Image.Transpose, op)) if op else img
+    img = Image.open(path)
+    if img.format == 'JPEG':
+        img.draft('RGB', (size, size))
+    return ImageOps.exif_transpose(img)
@@ -0,0 +1,113 @@
+from __future__ import annotations
+from pathlib import Path
+import signal
+import threading
+import time
+from typing import Optional
+
+from ..config import get_config
+from ..hardware.power import PowerMonitor, monitor_from_config
+from ..paths import Paths
+from .cache import PreviewCache
+from .generate import ProxyPool, job_outputs
+from .jobqueue import ProxyQueue
+from .sidecars import prune_staged
+
+
+# Staged camera sidecars are checked this often; one without a queued job goes after
+# STAGED_ORPHAN_S (a backup stages a card's sidecars before the run's jobs are queued)
+PRUNE_INTERVAL_S = 600.0
+STAGED_ORPHAN_S = 6 * 3600.0
+
+
+def _trip_of(paths: Paths, src: Path) -> Optional[str]:
+    try:
+        return src.relative_to(paths.trips).parts[0]
+    except (ValueError, IndexError):
+        return None
+
+
+def _pool_shape(previews: dict) -> tuple:
+    return int(previews.get('workers', 0)) or None, int(previews.get('max_transcodes', 2))
+
+
+def _configure(pool: ProxyPool, previews: dict) -> None:
+    """Apply the settings a pool picks up between batches, without being rebuilt."""
+    pool.height = int(previews['video_height'])
+    pool.bitrate = str(previews['video_bitrate'])
+    pool.webp = bool(previews.get('webp', False))
+    pool.use_sidecars = bool(previews.get('use_camera_proxies', True))
+
+
+def run_worker(paths: Paths, cfg: Optional[dict] = None, stop: Optional[threading.Event] = None, poll_s: Optional[float] = None,
+               power: Optional[PowerMonitor] = None) -> None:
+    """Consume the proxy queue until stop is set, polling for new jobs when idle.
+
+    Without an explicit cfg the worker follows the live config: settings
+    saved from the web UI (cache limit, pinning, WebP, proxy size, pool
+    size) apply from the next batch. ``poll_s`` defaults to
+    ``previews.poll_interval_s``. Builds slow down or pause with the power
+    level (see ProxyPool); a monitor is started for the duration unless one
+    is passed in.
+    """
+    stop = stop or threading.Event()
+    live = cfg is None
+    own_power = power is None
+    if own_power:
+        power = monitor_from_config(get_config() if live else cfg).start()
+    pool: Optional[ProxyPool] = None
+    shape = None
+    q = ProxyQueue(paths.proxy_queue_db)
+    cache = PreviewCache(paths.proxies_dir(), lambda: q.trips_by_key(paths.trips))
+    pruned_at = float('-inf')
+    try:
+        q.recover()
+        while not stop.is_set():
+            # Cached: a dict lookup unless config.yml changed
+            previews = (get_config() if live else cfg)['previews']
+            if time.monotonic() - pruned_at >= PRUNE_INTERVAL_S:
+                pruned_at = time.monotonic()
+                prune_staged(paths.proxies_dir(), q.queued_keys(), STAGED_ORPHAN_S,
+                             float(previews.get('staged_max_age_days', 7)) * 86400)
+            if _pool_shape(previews) != shape:
+                if pool is not None:
+                    pool.close()
+                shape = _pool_shape(previews)
+                pool = ProxyPool(*shape, power=power)
+            _configure(pool, previews)
+            # Small batches, so newly queued photos overtake a long backlog of videos
+            jobs = q.claim(pool.workers * 2)
+            if not jobs:
+                stop.wait(poll_s if poll_s is not None else float(previews.get('poll_interval_s', 5)))
+                continue
+            for job, ok in zip(jobs, pool.run(jobs)):
+                if ok:
+                    for p in job_outputs(job):
+                        cache.add(p, _trip_of(paths, job.src))
+                    q.done(job)
+                else:
+                    q.failed(job, 'preview build failed')
+            # The trip can be renamed in the settings while we run
+            pin = bool(previews.get('pin_current_trip', True))
+            cache.evict(int(previews['max_cache_gb'] * 1_000_000_000), paths.trip.name if pin else None)
+    finally:
+        if pool is not None:
+            pool.close()
+        q.close()
+        cache.close()
+        if own_power:
+            power.stop()
+
+
+def main():
+    paths = Paths().ensure()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        run_worker(paths, stop=stop)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+from __future__ import annotations
+from pathlib import Path
+import sqlite3
+
+
+# The UI, the proxy worker and the web UI share these databases across threads
+# and processes: a writer waits this long for another one instead of failing
+# with "database is locked".
+BUSY_TIMEOUT_S = 30
+
+
+def connect(db_path: Path, schema: str) -> sqlite3.Connection:
+    """Open a state database (WAL, shared between threads) and create its schema.
+
+    ``schema`` is a script of ``CREATE ... IF NOT EXISTS`` statements. Callers
+    serialise access to the connection with their own lock.
+    """
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(db_path), timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=NORMAL')
+    db.executescript(schema)
+    db.commit()
+    return db
@@ -0,0 +1,63 @@
+from __future__ import annotations
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from ..events import EventBus
+from .screens import ScreenBase
+
+
+class ProgressDisplay:
+    """Display consumer for backup progress events.
+
+    Runs on its own thread so the copy threads never wait for the e-paper.
+    Events are coalesced to the latest one; the panel is refreshed at most
+    every ``interval_s`` seconds, or after ``min_interval_s`` when the change is
+    significant (another device, or progress moved by ``step`` or more).
+    """
+
+    def __init__(self, disp, bus: EventBus, screen_for: Callable[[Any], ScreenBase], topic: str = 'backup.progress',
+                 interval_s: float = 10.0, min_interval_s: float = 3.0, step: float = 0.1):
+        self.disp = disp
+        self.screen_for = screen_for
+        self.interval_s = interval_s
+        self.min_interval_s = min_interval_s
+        self.step = step
+        self._bus = bus
+        self._sub = bus.subscribe(topic, maxlen=16)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='progress-display', daemon=True)
+        self._shown: Optional[Any] = None
+        self._last_render = 0.0
+
+    def start(self) -> 'ProgressDisplay':
+        # The caller has just drawn the initial screen
+        self._last_render = time.monotonic()
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._bus.unsubscribe(self._sub)
+
+    def _significant(self, p) -> bool:
+        if self._shown is None:
+            return True
+        if getattr(p, 'device', None) != getattr(self._shown, 'device', None):
+            return True
+        return abs(p.fraction - self._shown.fraction) >= self.step
+
+    def _run(self) -> None:
+        pending = None
+        while not self._stop.is_set():
+            events = self._sub.drain(timeout=0.5)
+            if events:
+                pending = events[-1].payload
+            if pending is None:
+                continue
+            elapsed = time.monotonic() - self._last_render
+            if elapsed >= self.interval_s or (elapsed >= self.min_interval_s and self._significant(pending)):
+                self.disp.render(self.screen_for(pending).draw())
+                self._shown, pending = pending, None
+                self._last_render = time.monotonic()
@@ -7,6 +7,9 @@ from PIL import Image, ImageDraw
 from ..hardware.display import load_font
 
 
+VERIFY_LABELS = {'fast': 'Fast', 'sampled': 'Sampled', 'blake2b': 'BLAKE2b', 'sha256': 'SHA256'}
+
+
 @dataclass
 class ScreenContext:
     language: str = 'en'
@@ -61,6 +64,7 @@ class InfoScreen(ScreenBase):
             f"Photo: {self.stats.get('photo_count','0')}",
             f"Free: {self.stats.get('free_gb','0gb')}",
             f"Cards backed up: {self.stats.get('cards',0)}",
+            f"Previews: {self.stats.get('previews','?')}",
         ]
         for line in lines:
             d.text((8, y), line, font=self.font_mid, fill=0)
@@ -179,7 +183,7 @@ class SettingsScreen(ScreenBase):
         d.text((8, 6), 'Settings', font=self.font_h1, fill=0)
         y = 38
         items = [
-            ("Verification:", 'Fast' if self.verify=='fast' else 'SHA256'),
+            ("Verification:", VERIFY_LABELS.get(self.verify, self.verify)),
             ("Power-off:", self.power_off),
             ("Tone:", 'On' if self.tone else 'Off'),
         ]
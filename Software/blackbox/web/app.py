@@ -1,15 +1,38 @@
 from __future__ import annotations
-from flask import Flask, jsonify, send_file, render_template_string, request
+from flask import Flask, jsonify, redirect, send_file, render_template_string, request
 from pathlib import Path
+import hashlib
 import os
-from ..config import load_config, save_config
+import threading
+import time
+from ..config import get_config, load_config, save_config
+from ..backup.manifest import Manifest
+from ..inventory import PHOTO, VIDEO, MediaEntry, media_kind
+from ..mediaindex import NAME, NEWEST, MediaIndex, Page
+from ..proxies.cache import PreviewCache
+from ..proxies.generate import GRID_SIZE, THUMB_SIZE, content_key, pending_jobs, proxy_name_for, thumb_name_for, thumb_variant
+from ..proxies.jobqueue import ProxyQueue
+from ..proxies.live import PLAYLIST, SEGMENT_RE, LiveStreams, StreamBusy, StreamFailed, hls_dir
 from ..paths import Paths
 
 
+# Responses under a content-versioned URL never change: let browsers keep them for a year
+IMMUTABLE_S = 365 * 24 * 3600
+
+
 def create_app() -> Flask:
-    cfg = load_config()
-    paths = Paths(cfg).ensure()
+    paths = Paths().ensure()
     app = Flask(__name__)
+    proxy_queue = ProxyQueue(paths.proxy_queue_db)
+    preview_cache = PreviewCache(paths.proxies_dir(), lambda: proxy_queue.trips_by_key(paths.trips))
+    live = LiveStreams(preview_cache)
+
+    def _live_settings() -> None:
+        # Per request, so live stream settings saved in /settings apply at once (the config is cached)
+        previews = get_config()['previews']
+        live.max_sessions = max(1, int(previews.get('max_live_transcodes', 1)))
+        live.height = int(previews.get('live_height', 360))
+        live.bitrate = str(previews.get('live_bitrate', '800k'))
 
     @app.get('/')
     def home():
@@ -19,113 +42,185 @@ def create_app() -> Flask:
             <body>
             <h1>Blackbox</h1>
             <p><a href="/photos">Photos</a> | <a href="/videos">Videos</a> | <a href="/settings">Settings</a></p>
+            <p>Previews: {{jobs['pending'] + jobs['running']}} queued, {{jobs['done']}} done{% if jobs['failed'] %}, {{jobs['failed']}} failed{% endif %}</p>
             </body></html>
-            """
+            """,
+            jobs=proxy_queue.status(),
         )
 
-    def _iter_media(root: Path, suffixes: set[str]):
-        for dp, _, files in os.walk(root):
-            for fn in files:
-                p = Path(dp) / fn
-                if p.suffix.lower() in suffixes:
-                    yield p
+    @app.get('/api/previews')
+    def api_previews():
+        return jsonify(proxy_queue.status())
 
-    PHOTO_EXTS = {'.jpg', '.jpeg', '.png', '.rw2', '.cr2', '.nef', '.raf', '.dng', '.arw'}
-    VIDEO_EXTS = {'.mp4', '.mov', '.m4v'}
+    media_index = MediaIndex(paths.media_db)
+    manifest = Manifest(paths.manifest_db, paths.trips)
+    reconciled: dict[str, float] = {}
+    reconcile_lock = threading.Lock()
 
-    @app.get('/api/photos')
-    def api_photos():
-        root = paths.photos_dir()
-        items = [str(p.relative_to(paths.trip_root())) for p in _iter_media(root, PHOTO_EXTS)]
-        page = int(request.args.get('page', 1))
-        size = int(load_config().get('web', {}).get('page_size', 50))
-        start = (page - 1) * size
-        end = start + size
+    def _page(kind: str, default_order: str) -> Page:
+        """Page of the current trip's media from the index; reconciles it with the disk every index_refresh_s."""
+        trip = paths.trip_root()
+        web = get_config().get('web', {})
+        with reconcile_lock:
+            now = time.monotonic()
+            if now - reconciled.get(trip.name, float('-inf')) >= float(web.get('index_refresh_s', 30)):
+                media_index.reconcile(trip.name, trip)
+                reconciled[trip.name] = now
+        size = int(web.get('page_size', 50))
+        return media_index.page(trip.name, kind, request.args.get('order', default_order), size,
+                                after=request.args.get('after'), before=request.args.get('before'), root=trip)
+
+    def _api(kind: str):
+        try:
+            page = _page(kind, NAME)
+        except ValueError as e:
+            return str(e), 400
         return jsonify({
-            'page': page,
-            'page_size': size,
-            'total': len(items),
-            'items': items[start:end],
+            'page_size': int(get_config().get('web', {}).get('page_size', 50)),
+            'total': page.total,
+            'items': [e.rel for e in page.items],
+            'next': page.next,
+            'prev': page.prev,
         })
 
+    def _version(e: MediaEntry) -> str:
+        # The preview key, computed from the index row without touching the file
+        return content_key(e.name, e.size, e.mtime_ns)
+
+    def _send_cached(path: Path, versioned: bool, **kwargs):
+        """Send a cache file with a strong ETag from its name and size.
+
+        Cache names are content keys (source name, size and mtime), so the
+        name stands for the source content; the size is added so a preview
+        rebuilt differently under the same key (e.g. a camera proxy replaced
+        by a transcode) gets a new tag. Under a URL carrying the current
+        version (``v``) the response is immutable; otherwise browsers
+        revalidate and get a 304 while it matches.
+        """
+        tag = f'{path.name}\0{path.stat().st_size}'
+        etag = hashlib.sha1(tag.encode('utf-8', 'surrogateescape')).hexdigest()[:20]
+        rv = send_file(path, etag=etag, max_age=IMMUTABLE_S if versioned else None, **kwargs)
+        if versioned:
+            rv.cache_control.immutable = True
+        return rv
+
+    def _nav(route: str, page: Page) -> str:
+        order = request.args.get('order', NEWEST)
+        links = [f'<a href="/{route}?order={order}&before={page.prev}">Prev</a>' if page.prev else 'Prev',
+                 f'<a href="/{route}?order={order}&after={page.next}">Next</a>' if page.next else 'Next']
+        return f'<div>{" | ".join(links)}</div>'
+
+    @app.get('/api/photos')
+    def api_photos():
+        return _api(PHOTO)
+
     @app.get('/api/videos')
     def api_videos():
-        root = paths.trip_root()
-        items = []
-        for p in _iter_media(root, VIDEO_EXTS):
-            items.append(str(p.relative_to(paths.trip_root())))
-        page = int(request.args.get('page', 1))
-        size = int(load_config().get('web', {}).get('page_size', 50))
-        start = (page - 1) * size
-        end = start + size
-        return jsonify({
-            'page': page,
-            'page_size': size,
-            'total': len(items),
-            'items': items[start:end],
-        })
+        return _api(VIDEO)
 
     @app.get('/photos')
     def photos():
-        root = paths.photos_dir()
-        items = [str(p.relative_to(paths.trip_root())) for p in _iter_media(root, PHOTO_EXTS)]
-        items.sort(key=lambda s: (paths.trip_root()/s).stat().st_mtime, reverse=True)
-        page = int(request.args.get('page', 1))
-        size = int(load_config().get('web', {}).get('page_size', 50))
-        start = (page - 1) * size
-        end = start + size
-        page_items = items[start:end]
+        try:
+            page = _page(PHOTO, NEWEST)
+        except ValueError as e:
+            return str(e), 400
         html_items = '\n'.join(
-            f'<a href="/download?p={i}"><img loading="lazy" style="max-width: 220px; margin:6px" src="/preview/photo?p={i}"></a>'
-            for i in page_items
+            f'<a href="/download?p={e.rel}"><img loading="lazy" style="max-width: 220px; margin:6px" src="/preview/photo?p={e.rel}&size=240&v={_version(e)}"></a>'
+            for e in page.items
         )
-        nav = f'<div><a href="/photos?page={max(1, page-1)}">Prev</a> | <a href="/photos?page={page+1}">Next</a></div>'
+        nav = _nav('photos', page)
         return render_template_string(f"<h1>Photos</h1>{nav}<div>{html_items}</div>{nav}")
 
     @app.get('/videos')
     def videos():
-        root = paths.trip_root()
-        items = [str(p.relative_to(paths.trip_root())) for p in _iter_media(root, VIDEO_EXTS)]
-        items.sort(key=lambda s: (paths.trip_root()/s).stat().st_mtime, reverse=True)
-        page = int(request.args.get('page', 1))
-        size = int(load_config().get('web', {}).get('page_size', 50))
-        start = (page - 1) * size
-        end = start + size
-        page_items = items[start:end]
+        try:
+            page = _page(VIDEO, NEWEST)
+        except ValueError as e:
+            return str(e), 400
         html_items = '\n'.join(
-            f'<div style="margin:8px 0"><video controls preload="metadata" width="320" src="/preview/video?p={i}"></video>\n'
-            f'<div><a href="/download?p={i}">Download original</a></div></div>'
-            for i in page_items
+            f'<div style="margin:8px 0"><video controls preload="metadata" width="320" poster="/preview/photo?p={e.rel}&size=240&v={_version(e)}" src="/preview/video?p={e.rel}&v={_version(e)}"></video>\n'
+            f'<div><a href="/download?p={e.rel}">Download original</a></div></div>'
+            for e in page.items
         )
-        nav = f'<div><a href="/videos?page={max(1, page-1)}">Prev</a> | <a href="/videos?page={page+1}">Next</a></div>'
+        nav = _nav('videos', page)
         return render_template_string(f"<h1>Videos</h1>{nav}<div>{html_items}</div>{nav}")
 
+    def _requeue(path: Path, rel: str, kind: str, st: os.stat_result) -> None:
+        """Queue a preview that is missing (evicted, or never built) for the worker."""
+        proxy_queue.enqueue(pending_jobs([MediaEntry(path, rel, kind, st.st_size, st.st_mtime_ns)], paths.proxies_dir()))
+
     @app.get('/preview/photo')
     def preview_photo():
         rel = request.args.get('p')
         if not rel:
             return 'missing p', 400
-        from ..proxies.generate import thumb_name_for
+        try:
+            want = int(request.args.get('size', THUMB_SIZE))
+        except ValueError:
+            return 'bad size', 400
         path = paths.trip_root() / rel
-        thumb = thumb_name_for(path, paths.proxies_dir())
-        if thumb.exists():
-            return send_file(thumb)
-        # fallback to original
-        if path.exists():
-            return send_file(path)
-        return 'not found', 404
+        try:
+            st = path.stat()
+        except OSError:
+            return 'not found', 404
+        primary = thumb_name_for(path, paths.proxies_dir(), st)
+        # Smallest pyramid level covering the request, WebP first if the browser takes it
+        sizes = [s for s in (GRID_SIZE, THUMB_SIZE) if s >= want] or [THUMB_SIZE]
+        fmts = ['webp', 'jpg'] if 'image/webp' in request.headers.get('Accept', '') else ['jpg']
+        for size in sizes:
+            for fmt in fmts:
+                thumb = thumb_variant(primary, size, fmt)
+                if thumb.exists():
+                    preview_cache.touch(thumb)
+                    rv = _send_cached(thumb, request.args.get('v') == primary.stem)
+                    rv.vary.add('Accept')
+                    return rv
+        # fallback to original (videos only have a poster if the camera made one); the
+        # thumbnail replaces it once built, so this answer must not be cached for good
+        if media_kind(path.name) != PHOTO:
+            return 'not found', 404
+        _requeue(path, rel, PHOTO, st)
+        return _send_original(path, st)
 
     @app.get('/preview/video')
     def preview_video():
         rel = request.args.get('p')
         if not rel:
             return 'missing p', 400
-        from ..proxies.generate import proxy_name_for
         path = paths.trip_root() / rel
-        proxy = proxy_name_for(path, paths.proxies_dir())
+        try:
+            st = path.stat()
+        except OSError:
+            return 'not found', 404
+        proxy = proxy_name_for(path, paths.proxies_dir(), st)
         if proxy.exists():
-            return send_file(proxy)
-        return 'not found', 404
+            preview_cache.touch(proxy)
+            return _send_cached(proxy, request.args.get('v') == proxy.stem)
+        # No proxy yet: stream a just-in-time HLS transcode instead
+        _requeue(path, rel, VIDEO, st)
+        key = proxy.stem
+        _live_settings()
+        try:
+            live.open(path, key)
+        except StreamBusy as e:
+            return 'busy, try again shortly', 503, {'Retry-After': str(e.retry_after_s)}
+        except StreamFailed:
+            return 'could not start the preview stream', 500
+        return redirect(f'/live/{key}/{PLAYLIST}')
+
+    @app.get('/live/<key>/<name>')
+    def live_segment(key: str, name: str):
+        if '/' in key or key.startswith('.') or not SEGMENT_RE.match(name):
+            return 'not found', 404
+        f = hls_dir(paths.proxies_dir(), key) / name
+        if not f.exists():
+            return 'not found', 404
+        live.touch(key)
+        # The playlist grows while the transcode runs: never let it be cached. Segments
+        # live under the content key and are final once listed.
+        if name == PLAYLIST:
+            return send_file(f, mimetype='application/vnd.apple.mpegurl', max_age=0)
+        return _send_cached(f, True, mimetype='video/mp2t')
 
     @app.get('/download')
     def download():
@@ -133,9 +228,27 @@ def create_app() -> Flask:
         if not rel:
             return 'missing p', 400
         path = paths.trip_root() / rel
-        if not path.exists():
+        try:
+            st = path.stat()
+        except OSError:
             return 'not found', 404
-        return send_file(path, as_attachment=True)
+        return _send_original(path, st, as_attachment=True)
+
+    def _send_original(path: Path, st: os.stat_result, **kwargs):
+        """Send a backed-up original with a strong validator, revalidated on every use.
+
+        The ETag is the SHA256 recorded at backup time when the manifest has it,
+        else derived from name, size and mtime (which the backup preserves).
+        Range and If-Range requests are answered with 206, so interrupted
+        downloads resume.
+        """
+        # peek: a GET must not drop manifest rows (the backup revalidates stale ones)
+        entry = manifest.peek(path, st)
+        if entry is not None and entry.sha256:
+            etag = entry.sha256
+        else:
+            etag = content_key(path.name, st.st_size, st.st_mtime_ns).rpartition('-')[2]
+        return send_file(path, etag=etag, **kwargs)
 
     def _render_settings_form(cfg: dict) -> str:
         return render_template_string(
@@ -149,7 +262,9 @@ def create_app() -> Flask:
               </fieldset>
               <fieldset><legend>Verification</legend>
                 Mode: <select name="verify.default_mode">
-                  <option value="fast" {% if cfg['verify']['default_mode']=='fast' %}selected{% endif %}>Fast</option>
+                  <option value="fast" {% if cfg['verify']['default_mode']=='fast' %}selected{% endif %}>Fast (size only)</option>
+                  <option value="sampled" {% if cfg['verify']['default_mode']=='sampled' %}selected{% endif %}>Sampled (head, tail, stripes)</option>
+                  <option value="blake2b" {% if cfg['verify']['default_mode']=='blake2b' %}selected{% endif %}>BLAKE2b (full, faster)</option>
                   <option value="sha256" {% if cfg['verify']['default_mode']=='sha256' %}selected{% endif %}>SHA256</option>
                 </select>
               </fieldset>
@@ -200,6 +315,6 @@ def create_app() -> Flask:
 
 
 if __name__ == '__main__':
-    cfg = load_config()
+    cfg = get_config()
     app = create_app()
     app.run(host=cfg['web']['host'], port=int(cfg['web']['port']))
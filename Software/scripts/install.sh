@@ -35,5 +35,8 @@ sed -e "s|%h/Holiday-blackbox/Software|$SED_PATH|g" \
 sed -e "s|%h/Holiday-blackbox/Software|$SED_PATH|g" \
     -e "s|^ExecStart=.*blackbox.web.app|ExecStart=$VENVPY -m blackbox.web.app|" \
     "$DIR/systemd/blackbox-web.service" | sudo tee /etc/systemd/system/blackbox-web.service >/dev/null
+sed -e "s|%h/Holiday-blackbox/Software|$SED_PATH|g" \
+    -e "s|^ExecStart=.*blackbox.proxies.worker|ExecStart=$VENVPY -m blackbox.proxies.worker|" \
+    "$DIR/systemd/blackbox-proxies.service" | sudo tee /etc/systemd/system/blackbox-proxies.service >/dev/null
 sudo systemctl daemon-reload
-echo "Enable with: sudo systemctl enable --now blackbox.service blackbox-web.service"
+echo "Enable with: sudo systemctl enable --now blackbox.service blackbox-web.service blackbox-proxies.service"
@@ -23,6 +23,7 @@ fi
 
 echo "Restarting services..."
 sudo systemctl restart blackbox-web || true
+sudo systemctl restart blackbox-proxies || true
 sudo systemctl restart blackbox || true
 
 echo "Update complete."
@@ -0,0 +1,33 @@
+from pathlib import Path
+import os
+
+import pytest
+
+from blackbox import config
+from blackbox.paths import Paths
+
+
+@pytest.fixture
+def cfg(tmp_path, monkeypatch):
+    """Config with the NVMe under tmp_path; config.yml is written there, not next to the code."""
+    monkeypatch.setattr(config, 'USER_CONFIG_PATH', tmp_path / 'config.yml')
+    monkeypatch.setitem(config._cached, 'cfg', None)
+    c = config.load_config()
+    c['paths']['nvme_mount'] = str(tmp_path / 'nvme')
+    c['limits']['min_free_gb'] = 0
+    config.save_config(c)
+    return config.load_config()
+
+
+@pytest.fixture
+def paths(cfg):
+    return Paths(cfg).ensure()
+
+
+def make_card(root: Path, files: dict) -> Path:
+    """A fake card: {'DCIM/100X/A.JPG': size or bytes} below root."""
+    for rel, data in files.items():
+        p = root / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(os.urandom(data) if isinstance(data, int) else data)
+    return root
@@ -0,0 +1,43 @@
+import hashlib
+
+from blackbox.backup.scheduler import backup_sources
+
+from conftest import make_card
+
+
+def _digests(folder):
+    return sorted(hashlib.sha256(p.read_bytes()).hexdigest() for p in folder.iterdir() if not p.name.startswith('.'))
+
+
+def test_same_name_from_two_cards_and_folders_keeps_every_file(tmp_path, paths):
+    a = make_card(tmp_path / 'A', {'DCIM/100X/IMG_1.JPG': 1000, 'DCIM/101X/IMG_1.JPG': 2000})
+    b = make_card(tmp_path / 'B', {'DCIM/100X/IMG_1.JPG': 3000})
+    sources = [a / 'DCIM/100X/IMG_1.JPG', a / 'DCIM/101X/IMG_1.JPG', b / 'DCIM/100X/IMG_1.JPG']
+    expected = sorted(hashlib.sha256(p.read_bytes()).hexdigest() for p in sources)
+
+    results = backup_sources([a, b], paths, 'sha256')
+
+    assert not any(r.errors for r in results)
+    assert sum(r.copied_files for r in results) == 3
+    assert sum(r.replaced_files for r in results) == 0
+    assert sum(len(r.renamed) for r in results) == 2
+    assert _digests(paths.photos_dir()) == expected
+
+    # A rerun maps every source to the same name again and copies nothing
+    again = backup_sources([a, b], paths, 'sha256')
+    assert sum(r.copied_files for r in again) == 0
+    assert sum(r.skipped_files for r in again) == 3
+    assert _digests(paths.photos_dir()) == expected
+
+
+def test_changed_source_replaces_only_its_own_tagged_copy(tmp_path, paths):
+    a = make_card(tmp_path / 'A', {'DCIM/100X/IMG_1.JPG': 1000})
+    b = make_card(tmp_path / 'B', {'DCIM/100X/IMG_1.JPG': 2000})
+    backup_sources([a, b], paths, 'fast')
+    (b / 'DCIM/100X/IMG_1.JPG').write_bytes(b'x' * 2500)
+
+    results = backup_sources([b], paths, 'fast')
+
+    assert results[0].replaced_files == 1 and not results[0].errors
+    assert (paths.photos_dir() / 'IMG_1.JPG').stat().st_size == 1000
+    assert sorted(p.stat().st_size for p in paths.photos_dir().iterdir()) == [1000, 2500]
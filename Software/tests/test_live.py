@@ -0,0 +1,49 @@
+import pytest
+
+from blackbox.proxies.cache import PreviewCache
+from blackbox.proxies.live import LiveStreams, StreamBusy, StreamFailed, hls_dir
+
+
+def _live(tmp_path, monkeypatch, script, max_sessions=1):
+    live = LiveStreams(PreviewCache(tmp_path / 'cache'), max_sessions=max_sessions)
+    monkeypatch.setattr(live, '_command', lambda src, out: ['sh', '-c', script, 'sh', str(out)])
+    return live
+
+
+def test_stream_is_returned_once_its_playlist_exists(tmp_path, monkeypatch):
+    live = _live(tmp_path, monkeypatch, 'echo "#EXTM3U" > "$1/index.m3u8"; sleep 5')
+
+    assert live.open(tmp_path / 'a.mp4', 'a-0') == hls_dir(tmp_path / 'cache', 'a-0')
+
+
+def test_dead_transcode_fails_and_leaves_nothing_behind(tmp_path, monkeypatch):
+    live = _live(tmp_path, monkeypatch, 'exit 1')
+
+    with pytest.raises(StreamFailed):
+        live.open(tmp_path / 'a.mp4', 'a-0')
+
+    assert not hls_dir(tmp_path / 'cache', 'a-0').exists()
+    # The slot is free again
+    with pytest.raises(StreamFailed):
+        live.open(tmp_path / 'b.mp4', 'b-0')
+
+
+def test_missing_ffmpeg_fails_and_leaves_nothing_behind(tmp_path, monkeypatch):
+    live = LiveStreams(PreviewCache(tmp_path / 'cache'))
+    monkeypatch.setattr(live, '_command', lambda src, out: [str(tmp_path / 'no-such-ffmpeg')])
+
+    with pytest.raises(StreamFailed):
+        live.open(tmp_path / 'a.mp4', 'a-0')
+
+    assert not hls_dir(tmp_path / 'cache', 'a-0').exists()
+
+
+def test_at_capacity_and_slow_start_are_busy(tmp_path, monkeypatch):
+    live = _live(tmp_path, monkeypatch, 'sleep 5')
+
+    with pytest.raises(StreamBusy) as starting:
+        live.open(tmp_path / 'a.mp4', 'a-0', wait_s=0.3)
+    with pytest.raises(StreamBusy) as full:
+        live.open(tmp_path / 'b.mp4', 'b-0')
+
+    assert starting.value.retry_after_s < full.value.retry_after_s
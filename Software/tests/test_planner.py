@@ -0,0 +1,50 @@
+from blackbox.backup.backup import prepare_backup
+from blackbox.backup.cards import CardStore
+from blackbox.backup.journal import Journal
+from blackbox.backup.manifest import Manifest
+from blackbox.backup.planner import CHECK, COPY, REPLACE, SKIP, tagged_name
+from blackbox.backup.scheduler import backup_sources
+
+from conftest import make_card
+
+
+def _plan(card, paths):
+    return prepare_backup(card, paths, 'fast', Manifest(paths.manifest_db, paths.trips), Journal(paths.journal_db))
+
+
+def test_needed_bytes_counts_new_videos_with_their_staged_sidecars(tmp_path, paths):
+    card = make_card(tmp_path / 'card', {'DCIM/100GOPRO/GX010001.MP4': 5000, 'DCIM/100GOPRO/GL010001.LRV': 700,
+                                         'DCIM/100GOPRO/GX010001.THM': 30})
+
+    plan = _plan(card, paths)
+
+    assert [f.action for f in plan.files] == [COPY]
+    assert plan.needed_bytes == 5000 + 700 + 30
+
+
+def test_needed_bytes_counts_a_replacement_in_full(tmp_path, paths):
+    card = make_card(tmp_path / 'card', {'DCIM/100X/IMG_1.JPG': 1000})
+    first = _plan(card, paths)
+    # The plain name holds another card's file; ours is an earlier, shorter copy under the tagged name
+    paths.photos_dir().joinpath('IMG_1.JPG').write_bytes(b'o' * 10)
+    tagged = tagged_name(first.files[0].dst, first.card_id, 'DCIM/100X/IMG_1.JPG')
+    tagged.write_bytes(b'o' * 900)
+
+    plan = _plan(card, paths)
+
+    assert [(f.action, f.dst) for f in plan.files] == [(REPLACE, tagged)]
+    assert plan.needed_bytes == 1000
+
+
+def test_card_snapshot_skips_only_while_the_destination_matches_the_manifest(tmp_path, paths):
+    card = make_card(tmp_path / 'card', {'DCIM/100X/IMG_1.JPG': 1000, 'DCIM/100X/IMG_2.JPG': 1000})
+    backup_sources([card], paths, 'sha256')
+    cards = CardStore(paths.cards_db)
+    manifest = Manifest(paths.manifest_db, paths.trips)
+    # Same size, different content and mtime: e.g. edited in place on the NVMe
+    edited = paths.photos_dir() / 'IMG_2.JPG'
+    edited.write_bytes(b'e' * 1000)
+
+    plan = prepare_backup(card, paths, 'sha256', manifest, Journal(paths.journal_db), cards)
+
+    assert {f.dst.name: f.action for f in plan.files} == {'IMG_1.JPG': SKIP, 'IMG_2.JPG': CHECK}
@@ -0,0 +1,79 @@
+from blackbox.inventory import PHOTO, MediaEntry
+from blackbox.proxies.cache import INDEX_NAME, PreviewCache
+from blackbox.proxies.generate import content_key, pending_jobs, preview_path
+from blackbox.proxies.jobqueue import DONE, FAILED, MAX_ATTEMPTS, PENDING, ProxyQueue
+from blackbox.web.app import create_app
+
+
+def _photo(paths, trip, name, size=100):
+    src = paths.trips / trip / 'photos' / name
+    src.parent.mkdir(parents=True, exist_ok=True)
+    src.write_bytes(b'p' * size)
+    st = src.stat()
+    return MediaEntry(src, f'photos/{name}', PHOTO, st.st_size, st.st_mtime_ns)
+
+
+def _build(paths, q, entry):
+    (job,) = pending_jobs([entry], paths.proxies_dir())
+    q.enqueue([job])
+    (job,) = q.claim(1)
+    job.dst.write_bytes(b't' * 1000)
+    q.done(job)
+    return job.dst
+
+
+def test_rebuilt_index_keeps_trips_so_pinning_survives(paths):
+    q = ProxyQueue(paths.proxy_queue_db)
+    current = _build(paths, q, _photo(paths, 'Now', 'A.JPG'))
+    old = _build(paths, q, _photo(paths, 'Before', 'B.JPG'))
+    (paths.proxies_dir() / INDEX_NAME).unlink(missing_ok=True)   # index lost: rebuilt from the folder
+
+    cache = PreviewCache(paths.proxies_dir(), lambda: q.trips_by_key(paths.trips))
+    cache.evict(0, pinned_trip='Now')
+
+    assert current.exists() and not old.exists()
+
+
+def test_evicted_preview_is_queued_again(paths):
+    q = ProxyQueue(paths.proxy_queue_db)
+    entry = _photo(paths, 'Now', 'A.JPG')
+    thumb = _build(paths, q, entry)
+    PreviewCache(paths.proxies_dir()).add(thumb)
+    PreviewCache(paths.proxies_dir()).evict(0)
+
+    q.enqueue(pending_jobs([entry], paths.proxies_dir()))
+
+    assert q.status()[PENDING] == 1 and q.status()[DONE] == 0
+    assert q.claim(1)[0].dst == preview_path(paths.proxies_dir(), PHOTO, content_key('A.JPG', entry.size, entry.mtime_ns))
+
+
+def test_failed_job_stays_parked_when_its_preview_is_asked_for_again(paths):
+    q = ProxyQueue(paths.proxy_queue_db)
+    entry = _photo(paths, 'Now', 'BAD.JPG')
+    q.enqueue(pending_jobs([entry], paths.proxies_dir()))
+    for _ in range(MAX_ATTEMPTS):
+        q.failed(q.claim(1)[0], 'corrupt')
+    assert q.status()[FAILED] == 1
+
+    # What the web UI does for every view of a file without a preview
+    q.enqueue(pending_jobs([entry], paths.proxies_dir()))
+    assert q.status()[FAILED] == 1 and q.claim(1) == []
+
+    # A changed file gets its attempts back
+    entry.path.write_bytes(b'fixed' * 10)
+    st = entry.path.stat()
+    q.enqueue(pending_jobs([MediaEntry(entry.path, entry.rel, PHOTO, st.st_size, st.st_mtime_ns)], paths.proxies_dir()))
+    assert q.status()[PENDING] == 1
+
+
+def test_failed_job_stays_parked_across_gallery_views(paths):
+    q = ProxyQueue(paths.proxy_queue_db)
+    entry = _photo(paths, paths.trip.name, 'BAD.JPG')
+    q.enqueue(pending_jobs([entry], paths.proxies_dir()))
+    for _ in range(MAX_ATTEMPTS):
+        q.failed(q.claim(1)[0], 'corrupt')
+    client = create_app().test_client()
+
+    client.get('/preview/photo?p=photos/BAD.JPG&size=240')
+
+    assert q.status()[FAILED] == 1 and q.status()[PENDING] == 0
@@ -0,0 +1,86 @@
+import time
+
+from blackbox.backup.scanner import MountWatcher
+
+
+def _mountinfo(path, mounts):
+    path.write_text(''.join(f'{36 + i} 25 8:{i} / {m} rw,relatime shared:1 - vfat /dev/sd{i} rw\n'
+                            for i, m in enumerate(mounts)))
+
+
+def _watcher(tmp_path, mountinfo):
+    added, removed = [], []
+    w = MountWatcher([str(tmp_path / 'media')], added.append, removed.append, mountinfo=str(mountinfo))
+    return w, added, removed
+
+
+def test_plain_dcim_folders_count_alongside_mounts(tmp_path):
+    media = tmp_path / 'media'
+    (media / 'folder' / 'DCIM').mkdir(parents=True)                 # not a mount point
+    (media / 'pi' / 'CARD' / 'DCIM').mkdir(parents=True)            # mounted two levels down
+    (media / 'pi' / 'NODCIM').mkdir(parents=True)
+    mountinfo = tmp_path / 'mountinfo'
+    _mountinfo(mountinfo, ['/', str(media / 'pi' / 'CARD'), str(media / 'pi' / 'NODCIM')])
+    w, added, _ = _watcher(tmp_path, mountinfo)
+
+    w.refresh()
+
+    assert set(w.sources()) == {media / 'folder', media / 'pi' / 'CARD'}
+    assert set(added) == set(w.sources())
+
+
+def test_cards_present_at_start_are_listed_but_not_reported_as_added(tmp_path):
+    media = tmp_path / 'media'
+    (media / 'BOOT' / 'DCIM').mkdir(parents=True)
+    mountinfo = tmp_path / 'mountinfo'
+    _mountinfo(mountinfo, [str(media / 'BOOT')])
+    w, added, removed = _watcher(tmp_path, mountinfo)
+
+    w.refresh(notify=False)   # what start() does
+    assert media / 'BOOT' in w.sources() and added == []
+
+    (media / 'LATE' / 'DCIM').mkdir(parents=True)
+    _mountinfo(mountinfo, [str(media / 'BOOT'), str(media / 'LATE')])
+    w.refresh()
+    assert added == [media / 'LATE']
+
+    _mountinfo(mountinfo, [str(media / 'LATE')])
+    (media / 'BOOT' / 'DCIM').rmdir()
+    w.refresh()
+    assert removed == [media / 'BOOT']
+
+
+def test_without_mountinfo_falls_back_to_scanning_the_roots(tmp_path):
+    media = tmp_path / 'media'
+    (media / 'CARD' / 'DCIM').mkdir(parents=True)
+    w, added, _ = _watcher(tmp_path, tmp_path / 'missing')
+
+    w.refresh()
+
+    assert w.sources() == [media / 'CARD'] and added == [media / 'CARD']
+
+
+def test_a_failing_refresh_does_not_stop_the_watcher(tmp_path, monkeypatch):
+    media = tmp_path / 'media'
+    (media / 'CARD' / 'DCIM').mkdir(parents=True)
+    w, added, _ = _watcher(tmp_path, tmp_path / 'missing')
+    w.fallback_interval_s = 0.05
+    real = w.refresh
+    calls = []
+
+    def flaky(notify=True):
+        calls.append(1)
+        if len(calls) == 1:
+            raise OSError('card pulled')
+        real(notify)
+
+    monkeypatch.setattr(w, 'refresh', flaky)
+    w._thread.start()
+    try:
+        deadline = time.monotonic() + 5
+        while not added and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        w.stop()
+
+    assert added == [media / 'CARD'] and len(calls) >= 2
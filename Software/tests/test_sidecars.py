@@ -0,0 +1,36 @@
+import os
+import time
+
+from blackbox.proxies.sidecars import incoming_dir, prune_staged, stage_sidecars
+
+
+def _staged(cache, name, age_s):
+    p = incoming_dir(cache) / name
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_bytes(b's')
+    t = time.time() - age_s
+    os.utime(p, (t, t))
+    return p
+
+
+def test_prune_keeps_wanted_and_recent_files_only(tmp_path):
+    wanted = _staged(tmp_path, 'GX01-0123456789abcdef.lrv', 3600 * 10)
+    fresh = _staged(tmp_path, 'GX02-0123456789abcdef.thm', 60)
+    orphan = _staged(tmp_path, 'GX03-0123456789abcdef.lrv', 3600 * 10)
+    partial = _staged(tmp_path, '.GX04-0123456789abcdef.lrv.part', 3600 * 10)
+    stale = _staged(tmp_path, 'GX05-0123456789abcdef.lrv', 86400 * 8)
+
+    n = prune_staged(tmp_path, {'GX01-0123456789abcdef', 'GX05-0123456789abcdef'}, 6 * 3600, 7 * 86400)
+
+    assert n == 3
+    assert wanted.exists() and fresh.exists()
+    assert not orphan.exists() and not partial.exists() and not stale.exists()
+
+
+def test_staging_into_an_unusable_cache_is_not_fatal(tmp_path):
+    src = tmp_path / 'GL010001.LRV'
+    src.write_bytes(b'lrv')
+    cache = tmp_path / 'cache'
+    cache.write_bytes(b'')   # a file where the cache folder should be: mkdir fails
+
+    assert stage_sidecars([('GX010001-0123456789abcdef', [src])], cache) == 0
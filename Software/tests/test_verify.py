@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from blackbox.backup import backup as bk
+from blackbox.backup.manifest import Manifest
+
+from conftest import make_card
+
+
+@pytest.mark.parametrize('mode', bk.VERIFY_MODES)
+def test_source_truncated_mid_copy_is_rejected(tmp_path, paths, monkeypatch, mode):
+    card = make_card(tmp_path / 'card', {'DCIM/100X/A.JPG': 200_000})
+    src = card / 'DCIM/100X/A.JPG'
+    copy_file = bk.copy_file
+
+    def short_read(s, d, *args, **kwargs):
+        # The card drops out after 1000 bytes: the rest reads as EOF
+        if s == src and s.stat().st_size > 1000:
+            os.truncate(s, 1000)
+        return copy_file(s, d, *args, **kwargs)
+
+    monkeypatch.setattr(bk, 'copy_file', short_read)
+    result = bk.copy_from_source(card, paths, verify_mode=mode)
+
+    assert result.copied_files == 0
+    assert any('Verify failed' in e for e in result.errors)
+    dst = paths.photos_dir() / 'A.JPG'
+    assert not dst.exists()
+    manifest = Manifest(paths.manifest_db, paths.trips)
+    try:
+        assert manifest.lookup(dst) is None
+    finally:
+        manifest.close()
+
+
+def test_complete_copy_passes(tmp_path, paths):
+    card = make_card(tmp_path / 'card', {'DCIM/100X/A.JPG': 200_000})
+    result = bk.copy_from_source(card, paths, verify_mode='fast')
+    assert result.copied_files == 1 and not result.errors
+    assert (paths.photos_dir() / 'A.JPG').stat().st_size == 200_000
+
+
+def _copy(tmp_path, size):
+    src, dst = tmp_path / 'src.jpg', tmp_path / 'dst.jpg'
+    src.write_bytes(os.urandom(size))
+    dst.write_bytes(src.read_bytes())
+    return src, dst
+
+
+def test_sampled_reads_small_stripes_of_a_photo_sized_file(tmp_path):
+    v = bk.get_verifier('sampled', {'verify': {'sample_stripes': 8, 'sample_stripe_kb': 64}})
+    src, dst = _copy(tmp_path, 8 * 1024 * 1024)
+
+    assert v.verify(src, dst, 8 * 1024 * 1024, None, 8 * 1024 * 1024)
+    assert v.bytes_read == 10 * 64 * 1024
+
+
+def test_sampled_compares_small_files_whole(tmp_path):
+    v = bk.get_verifier('sampled', {'verify': {'sample_stripes': 8, 'sample_stripe_kb': 64}})
+    src, dst = _copy(tmp_path, 300_000)
+    data = bytearray(dst.read_bytes())
+    data[150_000] ^= 0xFF   # in the middle, between where head and tail stripes would be
+    dst.write_bytes(bytes(data))
+
+    assert not v.verify(src, dst, 300_000, None, 300_000)
+    assert v.bytes_read == 300_000
@@ -0,0 +1,101 @@
+import hashlib
+import os
+
+from blackbox.backup.manifest import Manifest
+from blackbox.proxies.generate import thumb_name_for
+from blackbox.web.app import create_app
+
+
+def _original(paths, data=b'o' * 100):
+    f = paths.trip_root() / 'photos' / 'IMG_1.JPG'
+    f.parent.mkdir(parents=True, exist_ok=True)
+    f.write_bytes(data)
+    Manifest(paths.manifest_db, paths.trips).record(f, hashlib.sha256(data).hexdigest())
+    return f
+
+
+def test_download_uses_the_recorded_sha256_as_etag(paths):
+    _original(paths)
+    client = create_app().test_client()
+
+    rv = client.get('/download?p=photos/IMG_1.JPG')
+
+    assert rv.headers['ETag'] == f'"{hashlib.sha256(b"o" * 100).hexdigest()}"'
+
+
+def test_download_of_a_changed_file_leaves_the_manifest_alone(paths):
+    f = _original(paths)
+    st = f.stat()
+    os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    client = create_app().test_client()
+
+    rv = client.get('/download?p=photos/IMG_1.JPG')
+
+    manifest = Manifest(paths.manifest_db, paths.trips)
+    assert rv.status_code == 200 and rv.headers['ETag'] != f'"{hashlib.sha256(b"o" * 100).hexdigest()}"'
+    assert manifest.peek(f) is None
+    assert manifest._db.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 1
+
+
+def test_cached_preview_etag_changes_with_its_size(paths):
+    f = _original(paths)
+    thumb = thumb_name_for(f, paths.proxies_dir())
+    client = create_app().test_client()
+
+    thumb.write_bytes(b't' * 10)
+    first = client.get('/preview/photo?p=photos/IMG_1.JPG').headers['ETag']
+    thumb.write_bytes(b't' * 20)
+    second = client.get('/preview/photo?p=photos/IMG_1.JPG').headers['ETag']
+
+    assert first != second
+
+
+def _thumb(paths):
+    f = _original(paths)
+    thumb = thumb_name_for(f, paths.proxies_dir())
+    thumb.write_bytes(b't' * 10)
+    return thumb
+
+
+def test_versioned_preview_is_immutable_and_unversioned_is_revalidated(paths):
+    thumb = _thumb(paths)
+    client = create_app().test_client()
+
+    versioned = client.get(f'/preview/photo?p=photos/IMG_1.JPG&v={thumb.stem}')
+    plain = client.get('/preview/photo?p=photos/IMG_1.JPG')
+
+    assert versioned.cache_control.immutable and versioned.cache_control.max_age == 365 * 24 * 3600
+    assert not plain.cache_control.immutable and plain.cache_control.max_age is None
+
+
+def test_matching_etag_gets_304(paths):
+    _thumb(paths)
+    client = create_app().test_client()
+    etag = client.get('/preview/photo?p=photos/IMG_1.JPG').headers['ETag']
+
+    rv = client.get('/preview/photo?p=photos/IMG_1.JPG', headers={'If-None-Match': etag})
+
+    assert rv.status_code == 304 and rv.data == b''
+
+
+def test_original_range_request_gets_206(paths):
+    _original(paths, bytes(range(100)))
+    client = create_app().test_client()
+
+    rv = client.get('/download?p=photos/IMG_1.JPG', headers={'Range': 'bytes=10-19'})
+
+    assert rv.status_code == 206
+    assert rv.headers['Content-Range'] == 'bytes 10-19/100'
+    assert rv.data == bytes(range(10, 20))
+
+
+def test_range_with_stale_if_range_gets_the_whole_file(paths):
+    _original(paths, bytes(range(100)))
+    client = create_app().test_client()
+    etag = client.get('/download?p=photos/IMG_1.JPG').headers['ETag']
+
+    resumed = client.get('/download?p=photos/IMG_1.JPG', headers={'Range': 'bytes=10-19', 'If-Range': etag})
+    stale = client.get('/download?p=photos/IMG_1.JPG', headers={'Range': 'bytes=10-19', 'If-Range': '"other"'})
+
+    assert resumed.status_code == 206
+    assert stale.status_code == 200 and stale.data == bytes(range(100))
@@ -0,0 +1,40 @@
+import threading
+
+from blackbox import config
+from blackbox.hardware.power import FakeSource, PowerMonitor
+from blackbox.proxies import worker
+from blackbox.proxies.jobqueue import ProxyQueue
+
+
+def test_worker_picks_up_settings_saved_while_running(paths, monkeypatch):
+    seen = []
+    stop = threading.Event()
+
+    def claim(self, n):
+        seen.append((n, pool_of[0].webp))
+        if len(seen) == 1:
+            # Saved from /settings while the worker runs
+            c = config.load_config()
+            c['previews'].update(webp=True, workers=3)
+            config.save_config(c)
+        else:
+            stop.set()
+        return []
+
+    pool_of = []
+    real_pool = worker.ProxyPool
+
+    def pool(*args, **kwargs):
+        # Remember the current pool: a new one is built when the pool size changes
+        pool_of[:] = [real_pool(*args, **kwargs)]
+        return pool_of[0]
+
+    monkeypatch.setattr(ProxyQueue, 'claim', claim)
+    monkeypatch.setattr(worker, 'ProxyPool', pool)
+    c = config.load_config()
+    c['previews'].update(webp=False, workers=1)
+    config.save_config(c)
+
+    worker.run_worker(paths, stop=stop, poll_s=0, power=PowerMonitor(FakeSource()))
+
+    assert seen == [(2, False), (6, True)]